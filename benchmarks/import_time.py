@@ -0,0 +1,69 @@
+"""Cold-start benchmark: how long a fresh interpreter takes to import the app.
+
+Each run imports the module in a new process (what every worker pays on startup) and
+records the wall time, plus the slowest modules reported by `python -X importtime`.
+
+    python -m benchmarks.import_time [--module src.main] [--runs 10] [--top 15] [--output results.json]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def time_import(module: str) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], cwd=ROOT, check=True)
+    return time.perf_counter() - started
+
+
+def slowest_modules(module: str, top: int) -> list:
+    """Modules with the largest cumulative import time, from one -X importtime run."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, check=True, capture_output=True, text=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({"module": name.strip(), "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+    return sorted(modules, key=lambda entry: entry["cumulative_ms"], reverse=True)[:top]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="src.main")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    # Warm the OS file cache and the bytecode cache before measuring
+    time_import(args.module)
+    timings = [time_import(args.module) for _ in range(args.runs)]
+    results = {
+        "module": args.module,
+        "runs": args.runs,
+        "median_ms": statistics.median(timings) * 1000,
+        "min_ms": min(timings) * 1000,
+        "max_ms": max(timings) * 1000,
+        "slowest_modules": slowest_modules(args.module, args.top),
+    }
+
+    print(f"import {args.module}: median {results['median_ms']:.1f} ms "
+          f"(min {results['min_ms']:.1f}, max {results['max_ms']:.1f}, {args.runs} runs)")
+    for entry in results["slowest_modules"]:
+        print(f"  {entry['cumulative_ms']:9.1f} ms  {entry['module']}")
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
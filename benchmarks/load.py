@@ -0,0 +1,461 @@
+"""Load benchmark: drives the API with a weighted mix of requests and records latency and throughput.
+
+Two modes:
+
+    inprocess   requests go straight to the ASGI app through httpx's ASGITransport: the app,
+                its middleware and the database, without HTTP parsing or sockets
+    socket      the app is served by the production launcher (src.server) on a free local
+                port, or --url points at a server that is already running
+
+Each of --concurrency clients picks requests from --mix until --duration seconds have passed,
+or until --requests requests were sent. Customers and orders are seeded first so that orders
+can be placed and read, and a --warmup phase runs before anything is recorded. The app runs
+against a throwaway SQLite database unless --database-url is given.
+
+Latency percentiles and requests/s, per scenario and overall, are printed and written as JSON
+(with the commit, configuration and environment) to --output, by default
+benchmarks/results/<timestamp>-<commit>.json, so runs can be compared across commits:
+
+    python -m benchmarks.load run [--mode inprocess|socket] [--concurrency 16] [--duration 10]
+                                  [--mix create_order=3,get_order=4] [--workers 2] [--output results.json]
+    python -m benchmarks.load compare baseline.json candidate.json
+
+A server error is a bug, not a data point: a run that got any 5xx response still writes its
+results, then exits with status 1.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+# Scenario weights: mostly order traffic, reads outnumbering writes
+DEFAULT_MIX = {
+    "create_customer": 1,
+    "create_customers_batch": 1,
+    "create_order": 3,
+    "get_order": 4,
+    "list_orders": 1,
+}
+
+# Data created before the run, so order writes and reads have customers and orders to use
+SEED_CUSTOMERS = 50
+SEED_ORDERS = 200
+
+# Seconds a launched server gets to start answering
+STARTUP_TIMEOUT = 30
+
+PERCENTILES = (50, 95, 99)
+
+
+class Workload:
+    """Builds and sends the requests of each scenario, tracking the customers and orders created."""
+
+    scenarios = tuple(DEFAULT_MIX)
+
+    def __init__(self, rng: random.Random, batch_size: int = 20, items_per_order: int = 3):
+        self.rng = rng
+        self.batch_size = batch_size
+        self.items_per_order = items_per_order
+        self.customers: List[str] = []
+        self.order_ids: List[int] = []
+        # Company names are unique, also across runs against the same database
+        self._prefix = f"bench-{uuid.uuid4().hex[:8]}"
+        self._sequence = itertools.count()
+
+    def customer(self) -> dict:
+        number = next(self._sequence)
+        return {
+            "company_name": f"{self._prefix}-{number}",
+            "customer_type": self.rng.choice(["Corporate", "SME", "Individual"]),
+            "tax_id": f"TAX{number:08d}",
+            "registration_date": datetime.now(timezone.utc).isoformat(),
+            "contact_email": f"buyer{number}@example.com",
+            "contact_phone": f"+1-555-{number % 10000:04d}",
+            "address": f"{number} Benchmark Street",
+            "credit_score": self.rng.randint(300, 850),
+            "approved_credit_limit": float(self.rng.randrange(1000, 100000, 500)),
+        }
+
+    def order(self) -> dict:
+        return {
+            "customer_id": self.rng.choice(self.customers),
+            "items": [
+                {
+                    "product_name": f"Product {self.rng.randint(1, 500)}",
+                    "quantity": self.rng.randint(1, 10),
+                    "unit_price": round(self.rng.uniform(1, 500), 2),
+                }
+                for _ in range(self.items_per_order)
+            ],
+        }
+
+    async def seed(self, client: httpx.AsyncClient, customers: int = SEED_CUSTOMERS, orders: int = SEED_ORDERS) -> None:
+        response = await client.post("/api/customers/batch", json=[self.customer() for _ in range(customers)])
+        response.raise_for_status()
+        self.customers.extend(response.json()["company_names"])
+        for _ in range(orders):
+            (await self.create_order(client)).raise_for_status()
+
+    async def create_customer(self, client: httpx.AsyncClient) -> httpx.Response:
+        customer = self.customer()
+        response = await client.post("/api/customers/", json=customer)
+        if response.status_code == 201:
+            self.customers.append(customer["company_name"])
+        return response
+
+    async def create_customers_batch(self, client: httpx.AsyncClient) -> httpx.Response:
+        response = await client.post("/api/customers/batch", json=[self.customer() for _ in range(self.batch_size)])
+        if response.status_code == 201:
+            self.customers.extend(response.json()["company_names"])
+        return response
+
+    async def create_order(self, client: httpx.AsyncClient) -> httpx.Response:
+        response = await client.post("/api/orders/", json=self.order())
+        if response.status_code == 201:
+            self.order_ids.append(response.json()["id"])
+        return response
+
+    async def get_order(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await client.get(f"/api/orders/{self.rng.choice(self.order_ids)}")
+
+    async def list_orders(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await client.get("/api/orders/", params={"customer_id": self.rng.choice(self.customers), "limit": 20})
+
+
+class Recorder:
+    """Latencies (seconds) and failures per scenario."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+
+    def record(self, scenario: str, seconds: float, error: Optional[str] = None) -> None:
+        self.latencies.setdefault(scenario, []).append(seconds)
+        if error is not None:
+            errors = self.errors.setdefault(scenario, {})
+            errors[error] = errors.get(error, 0) + 1
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def latency_summary(latencies: List[float], errors: Dict[str, int], elapsed: float) -> dict:
+    values = sorted(latencies)
+    summary = {
+        "requests": len(values),
+        "errors": sum(errors.values()),
+        "error_kinds": errors,
+        "requests_per_second": len(values) / elapsed if elapsed else 0.0,
+        "mean_ms": sum(values) / len(values) * 1000 if values else None,
+        "max_ms": values[-1] * 1000 if values else None,
+    }
+    for pct in PERCENTILES:
+        value = percentile(values, pct)
+        summary[f"p{pct}_ms"] = value * 1000 if value is not None else None
+    return summary
+
+
+async def drive(client: httpx.AsyncClient, workload: Workload, mix: Dict[str, int], recorder: Recorder,
+                concurrency: int, duration: float, requests: Optional[int] = None) -> float:
+    """Run `concurrency` clients until the duration is over or `requests` were sent; returns the elapsed time."""
+    names, weights = list(mix), list(mix.values())
+    budget = itertools.count() if requests is None else iter(range(requests))
+    started = time.perf_counter()
+    deadline = started + duration
+
+    async def client_loop() -> None:
+        while time.perf_counter() < deadline and next(budget, None) is not None:
+            scenario = workload.rng.choices(names, weights)[0]
+            sent = time.perf_counter()
+            try:
+                response = await getattr(workload, scenario)(client)
+            except httpx.HTTPError as exc:
+                recorder.record(scenario, time.perf_counter() - sent, type(exc).__name__)
+                continue
+            error = str(response.status_code) if response.status_code >= 400 else None
+            recorder.record(scenario, time.perf_counter() - sent, error)
+
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+
+@asynccontextmanager
+async def inprocess_client():
+    # Imported here, so that the DATABASE_URL chosen by main() is the one the app picks up
+    from src.main import create_app
+
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        # An exception escaping the app is answered with a 500 and counted, like a server would
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60) as client:
+            yield client
+
+
+@asynccontextmanager
+async def socket_client(url: str, concurrency: int):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        yield client
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def launched_server(workers: int) -> Iterator[str]:
+    """Serve the app with src.server on a free local port; yields its base URL."""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    # Create the schema once, so the workers do not race each other creating it
+    subprocess.run([sys.executable, "-c", "from src.CustomerOnboarding import init_db; init_db()"], cwd=ROOT, check=True)
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "src.server", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=ROOT, stdout=log, stderr=subprocess.STDOUT,
+    )
+    try:
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            if process.poll() is not None or time.monotonic() > deadline:
+                log.seek(0)
+                raise RuntimeError(f"Server did not start:\n{log.read().decode(errors='replace')[-2000:]}")
+            try:
+                if httpx.get(f"{url}/api/orders/", params={"limit": 1}).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            time.sleep(0.2)
+        yield url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=STARTUP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        log.close()
+
+
+def git_revision() -> dict:
+    def git(*args: str) -> str:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+
+    try:
+        return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    workload = Workload(random.Random(args.seed), batch_size=args.batch_size, items_per_order=args.items_per_order)
+    if args.mode == "inprocess":
+        client_context = inprocess_client()
+    else:
+        client_context = socket_client(args.url, args.concurrency)
+
+    async with client_context as client:
+        await workload.seed(client, args.seed_customers, args.seed_orders)
+        if args.warmup > 0:
+            await drive(client, workload, args.mix, Recorder(), args.concurrency, args.warmup)
+        recorder = Recorder()
+        elapsed = await drive(client, workload, args.mix, recorder, args.concurrency, args.duration, args.requests)
+
+    everything = [latency for latencies in recorder.latencies.values() for latency in latencies]
+    all_errors: Dict[str, int] = {}
+    for errors in recorder.errors.values():
+        for kind, count in errors.items():
+            all_errors[kind] = all_errors.get(kind, 0) + count
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git": git_revision(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "config": {
+            "mode": args.mode,
+            "url": args.url if args.mode == "socket" else None,
+            "workers": args.workers if args.mode == "socket" and args.launch else None,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "mix": args.mix,
+            "batch_size": args.batch_size,
+            "items_per_order": args.items_per_order,
+            "seed": args.seed,
+        },
+        "elapsed_seconds": elapsed,
+        "overall": latency_summary(everything, all_errors, elapsed),
+        "scenarios": {
+            scenario: latency_summary(recorder.latencies.get(scenario, []), recorder.errors.get(scenario, {}), elapsed)
+            for scenario in args.mix
+        },
+    }
+
+
+def server_errors(results: dict) -> Dict[str, int]:
+    """The 5xx responses of a run, by status code."""
+    return {kind: count for kind, count in results["overall"]["error_kinds"].items() if kind.startswith("5")}
+
+
+def format_ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def print_results(results: dict) -> None:
+    config = results["config"]
+    print(f"{config['mode']}: {config['concurrency']} clients, {results['elapsed_seconds']:.1f} s, "
+          f"commit {(results['git']['commit'] or 'unknown')[:12]}{' (dirty)' if results['git']['dirty'] else ''}")
+    print(f"{'scenario':<24}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = list(results["scenarios"].items()) + [("overall", results["overall"])]
+    for name, summary in rows:
+        print(f"{name:<24}{summary['requests']:>10}{summary['errors']:>8}{summary['requests_per_second']:>10.1f}"
+              f"{format_ms(summary['p50_ms']):>10}{format_ms(summary['p95_ms']):>10}{format_ms(summary['p99_ms']):>10}")
+
+
+def compare(baseline: dict, candidate: dict) -> List[dict]:
+    """Per scenario (and overall) change in throughput and tail latency, as percentages of the baseline."""
+    def change(before: Optional[float], after: Optional[float]) -> Optional[float]:
+        if not before or after is None:
+            return None
+        return (after - before) / before * 100
+
+    rows = []
+    scenarios = [name for name in candidate["scenarios"] if name in baseline["scenarios"]]
+    for name in scenarios + ["overall"]:
+        before = baseline["overall"] if name == "overall" else baseline["scenarios"][name]
+        after = candidate["overall"] if name == "overall" else candidate["scenarios"][name]
+        rows.append({
+            "scenario": name,
+            **{f"{key}_change_pct": change(before[key], after[key])
+               for key in ("requests_per_second", "p50_ms", "p95_ms", "p99_ms")},
+        })
+    return rows
+
+
+def print_comparison(baseline: dict, candidate: dict) -> None:
+    print(f"baseline  {(baseline['git']['commit'] or 'unknown')[:12]}  {baseline['timestamp']}")
+    print(f"candidate {(candidate['git']['commit'] or 'unknown')[:12]}  {candidate['timestamp']}")
+    differences = [key for key in candidate["config"] if candidate["config"][key] != baseline["config"].get(key)]
+    if differences:
+        print(f"note: the runs differ in {', '.join(differences)}")
+    print(f"{'scenario':<24}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for row in compare(baseline, candidate):
+        cells = [row[f"{key}_change_pct"] for key in ("requests_per_second", "p50_ms", "p95_ms", "p99_ms")]
+        print(f"{row['scenario']:<24}" + "".join("         -" if cell is None else f"{cell:>+9.1f}%" for cell in cells))
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in Workload.scenarios:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}, expected one of {', '.join(Workload.scenarios)}")
+        try:
+            mix[name] = int(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid weight for {name}: {weight!r}")
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one scenario with a positive weight")
+    return mix
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmark")
+    run.add_argument("--mode", choices=("inprocess", "socket"), default="inprocess")
+    run.add_argument("--url", help="socket mode: benchmark this running server instead of launching one")
+    run.add_argument("--workers", type=int, default=1, help="socket mode: worker processes of the launched server")
+    run.add_argument("--database-url", help="database of the benchmarked app (default: a throwaway SQLite file)")
+    run.add_argument("--concurrency", type=int, default=16)
+    run.add_argument("--duration", type=float, default=10.0, help="seconds of recorded load")
+    run.add_argument("--requests", type=int, help="stop after this many requests, even before the duration is over")
+    run.add_argument("--warmup", type=float, default=2.0, help="seconds of unrecorded load before the run")
+    run.add_argument("--mix", type=parse_mix, default=dict(DEFAULT_MIX),
+                     help="scenario=weight pairs (default: %s)" % ",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()))
+    run.add_argument("--batch-size", type=int, default=20, help="customers per batch creation")
+    run.add_argument("--items-per-order", type=int, default=3)
+    run.add_argument("--seed-customers", type=int, default=SEED_CUSTOMERS)
+    run.add_argument("--seed-orders", type=int, default=SEED_ORDERS)
+    run.add_argument("--seed", type=int, default=0, help="random seed of the request mix")
+    run.add_argument("--output", help="JSON results file (default: benchmarks/results/<timestamp>-<commit>.json)")
+
+    diff = commands.add_parser("compare", help="compare two result files")
+    diff.add_argument("baseline")
+    diff.add_argument("candidate")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        args.launch = args.mode == "socket" and args.url is None
+    return args
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    # Configured before the app is imported, so its per-request debug logs stay quiet; warnings still show
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if args.command == "compare":
+        print_comparison(json.loads(Path(args.baseline).read_text()), json.loads(Path(args.candidate).read_text()))
+        return
+
+    with tempfile.TemporaryDirectory(prefix="supplychain-bench-") as scratch:
+        # Set before the app is imported (inprocess) or launched (socket); .env does not override it
+        os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+        # Workers sharing the disk cache must not serve entries of another run's database
+        os.environ["CUSTOMER_CACHE_PATH"] = os.path.join(scratch, "customer_cache.db")
+        if args.launch:
+            with launched_server(args.workers) as args.url:
+                results = asyncio.run(run_benchmark(args))
+        else:
+            results = asyncio.run(run_benchmark(args))
+
+    print_results(results)
+    output = Path(args.output) if args.output else (
+        RESULTS_DIR / f"{time.strftime('%Y%m%dT%H%M%S')}-{(results['git']['commit'] or 'unknown')[:8]}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"results written to {output}")
+
+    failures = server_errors(results)
+    if failures:
+        summary = ", ".join(f"{count} x {kind}" for kind, count in sorted(failures.items()))
+        sys.exit(f"FAILED: the server answered with errors ({summary})")
+
+
+if __name__ == "__main__":
+    main()
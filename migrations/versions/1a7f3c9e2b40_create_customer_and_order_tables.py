@@ -0,0 +1,70 @@
+"""Create customer and order tables
+
+Revision ID: 1a7f3c9e2b40
+Revises: 
+Create Date: 2026-10-18 08:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a7f3c9e2b40'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Databases bootstrapped by Base.metadata.create_all already have these tables
+    existing_tables = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'customers' not in existing_tables:
+        op.create_table(
+            'customers',
+            sa.Column('company_name', sa.String(), nullable=False),
+            sa.Column('customer_type', sa.String(), nullable=True),
+            sa.Column('tax_id', sa.String(), nullable=True),
+            sa.Column('registration_date', sa.DateTime(), nullable=True),
+            sa.Column('contact_email', sa.String(), nullable=True),
+            sa.Column('contact_phone', sa.String(), nullable=True),
+            sa.Column('address', sa.String(), nullable=True),
+            sa.Column('credit_score', sa.Integer(), nullable=True),
+            sa.Column('approved_credit_limit', sa.Float(), nullable=True),
+            sa.Column('status', sa.String(), nullable=True),
+            sa.PrimaryKeyConstraint('company_name'),
+        )
+        op.create_index('ix_customers_company_name', 'customers', ['company_name'])
+
+    if 'orders' not in existing_tables:
+        op.create_table(
+            'orders',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('customer_id', sa.String(), nullable=True),
+            sa.Column('order_date', sa.DateTime(), nullable=True),
+            sa.Column('total_amount', sa.Float(), nullable=True),
+            sa.Column('status', sa.String(), nullable=True),
+            sa.ForeignKeyConstraint(['customer_id'], ['customers.company_name']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_orders_id', 'orders', ['id'])
+
+    if 'order_items' not in existing_tables:
+        op.create_table(
+            'order_items',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('order_id', sa.Integer(), nullable=True),
+            sa.Column('product_name', sa.String(), nullable=True),
+            sa.Column('quantity', sa.Integer(), nullable=True),
+            sa.Column('unit_price', sa.Float(), nullable=True),
+            sa.ForeignKeyConstraint(['order_id'], ['orders.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_order_items_id', 'order_items', ['id'])
+
+
+def downgrade() -> None:
+    op.drop_table('order_items')
+    op.drop_table('orders')
+    op.drop_table('customers')
@@ -0,0 +1,45 @@
+"""Add composite indexes for keyset-paginated customer and order listings
+
+Revision ID: 5b2d8c1e4f3a
+Revises: 1a7f3c9e2b40
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2d8c1e4f3a'
+down_revision = '1a7f3c9e2b40'
+branch_labels = None
+depends_on = None
+
+
+# (index name, table, columns); create_all from the current models already creates these
+LISTING_INDEXES = [
+    ('ix_customers_status_company_name', 'customers', ['status', 'company_name']),
+    ('ix_customers_customer_type_company_name', 'customers', ['customer_type', 'company_name']),
+    ('ix_orders_status_id', 'orders', ['status', 'id']),
+    ('ix_orders_customer_id_id', 'orders', ['customer_id', 'id']),
+    ('ix_orders_order_date', 'orders', ['order_date']),
+    ('ix_orders_total_amount', 'orders', ['total_amount']),
+    ('ix_order_items_order_id', 'order_items', ['order_id']),
+]
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns in LISTING_INDEXES:
+        if name not in {index['name'] for index in inspector.get_indexes(table)}:
+            op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_order_items_order_id', table_name='order_items')
+    op.drop_index('ix_orders_total_amount', table_name='orders')
+    op.drop_index('ix_orders_order_date', table_name='orders')
+    op.drop_index('ix_orders_customer_id_id', table_name='orders')
+    op.drop_index('ix_orders_status_id', table_name='orders')
+    op.drop_index('ix_customers_customer_type_company_name', table_name='customers')
+    op.drop_index('ix_customers_status_company_name', table_name='customers')
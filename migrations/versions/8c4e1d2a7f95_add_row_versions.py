@@ -0,0 +1,36 @@
+"""Add row version and updated_at columns to customers and orders
+
+Revision ID: 8c4e1d2a7f95
+Revises: 5b2d8c1e4f3a
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e1d2a7f95'
+down_revision = '5b2d8c1e4f3a'
+branch_labels = None
+depends_on = None
+
+VERSIONED_TABLES = ['customers', 'orders']
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for table in VERSIONED_TABLES:
+        existing_columns = {column['name'] for column in inspector.get_columns(table)}
+        with op.batch_alter_table(table) as batch_op:
+            if 'version' not in existing_columns:
+                batch_op.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+            if 'updated_at' not in existing_columns:
+                batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    for table in VERSIONED_TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('version')
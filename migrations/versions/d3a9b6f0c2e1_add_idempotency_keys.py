@@ -0,0 +1,37 @@
+"""Add idempotency_keys table
+
+Revision ID: d3a9b6f0c2e1
+Revises: 8c4e1d2a7f95
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a9b6f0c2e1'
+down_revision = '8c4e1d2a7f95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('idempotency_keys'):
+        op.create_table(
+            'idempotency_keys',
+            sa.Column('key', sa.String(), primary_key=True),
+            sa.Column('fingerprint', sa.String(), nullable=False),
+            sa.Column('status_code', sa.Integer(), nullable=False),
+            sa.Column('response_body', sa.Text(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+        )
+        inspector = sa.inspect(op.get_bind())
+    if 'ix_idempotency_keys_created_at' not in {index['name'] for index in inspector.get_indexes('idempotency_keys')}:
+        op.create_index('ix_idempotency_keys_created_at', 'idempotency_keys', ['created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_idempotency_keys_created_at', table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
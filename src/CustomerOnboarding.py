@@ -1,30 +1,96 @@
-from fastapi import APIRouter, HTTPException, Depends, status, File, UploadFile
-from pydantic import BaseModel
-from typing import List
-from datetime import datetime
-from sqlalchemy import Column, String, Integer, Float, DateTime, ForeignKey
-from sqlalchemy.orm import declarative_base, Session, relationship
-from sqlalchemy import create_engine
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, Response, status, File, UploadFile
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+from pydantic import BaseModel, ValidationError, conlist
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from sqlalchemy import Column, String, Integer, Float, DateTime, ForeignKey, Index, Text
+from sqlalchemy.orm import declarative_base, Session, relationship, selectinload, load_only
+from sqlalchemy import select, insert, delete
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm.exc import StaleDataError
 import os
+import json
+import logging
+import hashlib
+import time
+from functools import lru_cache
+from operator import attrgetter
 
-print("Current working directory:", os.getcwd())
+from src.engine import WRITE_TRANSACTION, create_async_db_engine, create_db_engine, get_database_url
+from src.write_coordinator import WriteCoordinator
+from src.cache import MISSING, RecordCache
+from src.singleflight import AsyncSingleFlight, SingleFlight
+from src.responses import FastJSONResponse, dumps
+from src.compression import no_compression
+from src.executor import DBExecutor, db_handler
+
+logger = logging.getLogger(__name__)
 
 # Use an absolute path for the database
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATABASE_URL = "sqlite:///./data/test.db"
+DATABASE_URL = get_database_url()
+
+# Sync engine for the customer endpoints, async engine on the same database for the order
+# endpoints. Both are created on first use rather than at import, so importing the app (test
+# collection, a pre-fork server's parent process) neither loads drivers nor opens connections.
+@lru_cache(maxsize=None)
+def get_engine() -> Engine:
+    return create_db_engine(DATABASE_URL)
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+@lru_cache(maxsize=None)
+def get_async_engine() -> AsyncEngine:
+    return create_async_db_engine(DATABASE_URL)
+
+def __getattr__(name: str) -> Any:
+    # Keeps `from src.CustomerOnboarding import engine, async_engine` working
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Define the APIRouter
 router = APIRouter(
     prefix="/api",
-    tags=["API"]
+    tags=["API"],
+    default_response_class=FastJSONResponse
 )
 
-# SQLAlchemy setup
+# SQLAlchemy setup: sessions bind to their engine when they first need a connection
+class _SyncBoundSession(Session):
+    def get_bind(self, *args, **kwargs):
+        if self.bind is None:
+            self.bind = get_engine()
+        return super().get_bind(*args, **kwargs)
+
+class _AsyncBoundSession(Session):
+    def get_bind(self, *args, **kwargs):
+        if self.bind is None:
+            self.bind = get_async_engine().sync_engine
+        return super().get_bind(*args, **kwargs)
+
 Base = declarative_base()
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(class_=_SyncBoundSession, autocommit=False, autoflush=False)
+AsyncSessionLocal = async_sessionmaker(sync_session_class=_AsyncBoundSession, autoflush=False, expire_on_commit=False)
+
+# Read-through cache of customer records by company_name (CUSTOMER_CACHE_* settings)
+customer_cache = RecordCache.from_env("CUSTOMER_CACHE")
+
+# Concurrent identical lookups share one in-flight query
+customer_flight = SingleFlight()
+order_flight = AsyncSingleFlight()
+
+# Optional group-commit writer (WRITE_COORDINATOR=1), mainly for SQLite deployments
+write_coordinator = WriteCoordinator.from_env(SessionLocal)
+
+# Sync customer handlers run on a thread pool sized to the engine's pool (DB_EXECUTOR_* settings)
+db_executor = DBExecutor.from_env(get_engine)
+run_on_db_executor = db_handler(db_executor)
 
 # Define the CustomerModel
 class CustomerModel(Base):
@@ -40,6 +106,17 @@ class CustomerModel(Base):
     credit_score = Column(Integer)
     approved_credit_limit = Column(Float)
     status = Column(String, default="pending")
+    # Row version (bumped by the ORM on every update) and modification time, for ETag/Last-Modified
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __mapper_args__ = {"version_id_col": version}
+
+    # Composite indexes serving the filtered, keyset-paginated listings
+    __table_args__ = (
+        Index("ix_customers_status_company_name", "status", "company_name"),
+        Index("ix_customers_customer_type_company_name", "customer_type", "company_name"),
+    )
 
 # Define the Order model
 class Order(Base):
@@ -50,23 +127,67 @@ class Order(Base):
     order_date = Column(DateTime, default=datetime.utcnow)
     total_amount = Column(Float)
     status = Column(String, default="pending")
-    items = relationship("OrderItem", back_populates="order")
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Items are never lazy loaded: queries must pick a loader strategy (see ORDER_ITEMS_LOADER)
+    items = relationship("OrderItem", back_populates="order", lazy="raise_on_sql")
+
+    __table_args__ = (
+        Index("ix_orders_status_id", "status", "id"),
+        Index("ix_orders_customer_id_id", "customer_id", "id"),
+        Index("ix_orders_order_date", "order_date"),
+        Index("ix_orders_total_amount", "total_amount"),
+    )
+
+    __mapper_args__ = {"version_id_col": version}
 
 # Define the OrderItem model
 class OrderItem(Base):
     __tablename__ = "order_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"))
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
     product_name = Column(String)
     quantity = Column(Integer)
     unit_price = Column(Float)
     order = relationship("Order", back_populates="items")
 
-# Create the database tables
-#Base.metadata.create_all(bind=engine)
-Base.metadata.create_all(bind=engine)
-print("Database tables created successfully.")
+# Stored outcome of a request sent with an Idempotency-Key header
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=False)
+    response_body = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    # Serves the TTL purge
+    __table_args__ = (
+        Index("ix_idempotency_keys_created_at", "created_at"),
+    )
+
+# Application startup and shutdown (called from the app's lifespan, not at import)
+def init_db() -> None:
+    """Create any missing tables; deployments managed by Alembic can skip this."""
+    # Every worker runs this at startup: on SQLite the write lock is taken before the tables
+    # are checked, so the workers create them one after another instead of failing
+    with get_engine().connect() as conn:
+        conn.execution_options(**WRITE_TRANSACTION)
+        with conn.begin():
+            Base.metadata.create_all(bind=conn)
+    logger.info("Database tables created successfully.")
+
+async def close_db() -> None:
+    """Stop the background workers and close every pooled connection."""
+    if write_coordinator is not None:
+        write_coordinator.stop()
+    if db_executor is not None:
+        db_executor.shutdown()
+    if get_async_engine.cache_info().currsize:
+        await get_async_engine().dispose()
+    if get_engine.cache_info().currsize:
+        get_engine().dispose()
 
 # Define the Pydantic models
 class Customer(BaseModel):
@@ -87,6 +208,15 @@ class Customer(BaseModel):
 class StatusUpdate(BaseModel):
     status: str
 
+# Upper bound on the keys resolved by one multi-get request
+MAX_LOOKUP_KEYS = 500
+
+class CustomerLookup(BaseModel):
+    company_names: conlist(str, min_items=1, max_items=MAX_LOOKUP_KEYS)
+
+class OrderLookup(BaseModel):
+    order_ids: conlist(int, min_items=1, max_items=MAX_LOOKUP_KEYS)
+
 class OrderItemCreate(BaseModel):
     product_name: str
     quantity: int
@@ -115,124 +245,640 @@ def get_db():
     finally:
         db.close()
 
+# Dependency to get an async database session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Loader strategy for Order.items: one extra SELECT ... WHERE order_id IN (...) per query,
+# whether the query returns a single order or a whole page of them
+ORDER_ITEMS_LOADER = selectinload(Order.items)
+
+def order_with_items_query():
+    return select(Order).options(ORDER_ITEMS_LOADER)
+
+@lru_cache(maxsize=256)
+def record_serializer(fields: Tuple[str, ...]) -> Callable[[Any], dict]:
+    """Pre-built serializer for a set of fields: one attrgetter, resolved once per projection."""
+    getter = attrgetter(*fields)
+    if len(fields) == 1:
+        return lambda record: {fields[0]: getter(record)}
+    return lambda record: dict(zip(fields, getter(record)))
+
+ORDER_FIELDS = ("id", "customer_id", "order_date", "total_amount", "status")
+ITEM_FIELDS = ("product_name", "quantity", "unit_price")
+CUSTOMER_FIELDS = tuple(column.key for column in CustomerModel.__table__.columns)
+
+def serialize_order(order: Order, fields: Tuple[str, ...] = ORDER_FIELDS + ("items",)) -> dict:
+    columns = tuple(field for field in fields if field != "items")
+    body = record_serializer(columns)(order) if columns else {}
+    if "items" in fields:
+        serialize_item = record_serializer(ITEM_FIELDS)
+        body["items"] = [serialize_item(item) for item in order.items]
+    return body
+
+def serialize_customer(customer: CustomerModel) -> dict:
+    return record_serializer(CUSTOMER_FIELDS)(customer)
+
+# Field projection (`fields=a,b`): only the requested columns are selected and serialized
+def parse_fields(fields: Optional[str], allowed: Tuple[str, ...]) -> Optional[Tuple[str, ...]]:
+    """Validate a comma-separated projection, returned in declaration order; None means all fields."""
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(field for field in allowed if field in requested)
+
+def load_only_fields(model, fields):
+    # The version columns are always loaded: they feed the ETag and Last-Modified headers
+    return load_only(*(getattr(model, field) for field in (*fields, "version", "updated_at")))
+
+def invalidate_customers(company_names: List[str]) -> None:
+    if customer_cache is not None:
+        customer_cache.invalidate(company_names)
+
+# Conditional GET support: ETags come from the row version, Last-Modified from updated_at
+def validator_headers(version: int, updated_at: Optional[datetime]) -> dict:
+    headers = {"ETag": f'"{version}"'}
+    if updated_at is not None:
+        headers["Last-Modified"] = format_datetime(updated_at.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+def is_not_modified(request: Request, version: int, updated_at: Optional[datetime]) -> bool:
+    """Evaluate If-None-Match (or, without it, If-Modified-Since) against the current row version."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or f'"{version}"' in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None and updated_at is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return updated_at.replace(tzinfo=timezone.utc, microsecond=0) <= since
+    return False
+
+def has_conditional_headers(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+def if_match_satisfied(if_match: str, version: int) -> bool:
+    """Evaluate an If-Match header against the current row version (strong comparison)."""
+    tags = {tag.strip() for tag in if_match.split(",")}
+    return "*" in tags or f'"{version}"' in tags
+
+# Write transactions: `fn(session)` does the work and returns plain data for the response.
+# With the write coordinator enabled it runs in the next group commit instead of on the
+# request's own session.
+def begin_write(db: Session) -> None:
+    """Start db's transaction as a write transaction (BEGIN IMMEDIATE on SQLite).
+
+    Whatever db read before runs in a deferred transaction that SQLite may refuse to upgrade,
+    so that transaction is ended first.
+    """
+    if db.in_transaction():
+        db.commit()
+    db.connection(execution_options=WRITE_TRANSACTION)
+
+async def begin_write_async(db: AsyncSession) -> None:
+    if db.in_transaction():
+        await db.commit()
+    await db.connection(execution_options=WRITE_TRANSACTION)
+
+# A versioned row changed between being read and updated: the ORM's version check raises
+# StaleDataError, answered with 409 (or `conflict_status`, 412 for requests sending If-Match)
+CONFLICT_DETAILS = {
+    409: "The record was modified concurrently; retry the request",
+    412: "Precondition Failed",
+}
+
+def write_conflict(status_code: int = 409) -> HTTPException:
+    return HTTPException(status_code=status_code, detail=CONFLICT_DETAILS[status_code])
+
+def run_write(db: Session, fn: Callable[[Session], Any], conflict_status: int = 409) -> Any:
+    try:
+        if write_coordinator is not None:
+            return write_coordinator.submit(fn).result()
+        begin_write(db)
+        result = fn(db)
+        db.commit()
+        return result
+    except StaleDataError:
+        raise write_conflict(conflict_status)
+
+async def run_write_async(db: AsyncSession, fn: Callable[[Session], Any], conflict_status: int = 409) -> Any:
+    try:
+        if write_coordinator is not None:
+            return await write_coordinator.run(fn)
+        await begin_write_async(db)
+        result = await db.run_sync(fn)
+        await db.commit()
+        return result
+    except StaleDataError:
+        raise write_conflict(conflict_status)
+
+# Idempotent writes: a request carrying an Idempotency-Key stores its response in the same
+# transaction as its write, and a retry with the same key and body gets that response back
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+IDEMPOTENT_REPLAY_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_KEY_TTL = timedelta(seconds=int(os.getenv("IDEMPOTENCY_KEY_TTL", 86400)))
+# Expired keys are purged by the first keyed write after this many seconds
+IDEMPOTENCY_PURGE_INTERVAL = 60
+_last_idempotency_purge = 0.0
+
+def request_fingerprint(method: str, path: str, payload: BaseModel) -> str:
+    return hashlib.sha256(f"{method} {path} ".encode() + dumps(payload.dict())).hexdigest()
+
+async def find_idempotent_response(db: AsyncSession, key: str, fingerprint: str) -> Optional[Response]:
+    """Replay the stored response for key, or None when the key is unknown or expired."""
+    stored = await db.get(IdempotencyKey, key)
+    if stored is None or stored.created_at < datetime.utcnow() - IDEMPOTENCY_KEY_TTL:
+        return None
+    if stored.fingerprint != fingerprint:
+        raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_KEY_HEADER} was already used for a different request")
+    return Response(
+        content=stored.response_body,
+        status_code=stored.status_code,
+        media_type="application/json",
+        headers={IDEMPOTENT_REPLAY_HEADER: "true"},
+    )
+
+def save_idempotent_response(session: Session, key: str, fingerprint: str, status_code: int, body: Any) -> None:
+    global _last_idempotency_purge
+    cutoff = datetime.utcnow() - IDEMPOTENCY_KEY_TTL
+    if time.monotonic() - _last_idempotency_purge >= IDEMPOTENCY_PURGE_INTERVAL:
+        _last_idempotency_purge = time.monotonic()
+        purge_idempotency_keys(session, cutoff)
+    else:
+        # An expired row still holds the primary key
+        session.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.created_at < cutoff))
+    session.add(IdempotencyKey(
+        key=key, fingerprint=fingerprint, status_code=status_code, response_body=dumps(body).decode()
+    ))
+    session.flush()
+
+def purge_idempotency_keys(session: Session, cutoff: datetime) -> int:
+    return session.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff)).rowcount
+
+# Keyset pagination: page size bounds and the header carrying the cursor for the next page
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def set_next_cursor(response: Response, rows: list, key: str, limit: int) -> None:
+    """Advertise the cursor of the next page when the current page is full."""
+    if len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(getattr(rows[-1], key))
+
+def customer_page_query(limit: int, after: Optional[str] = None,
+                        status: Optional[str] = None, customer_type: Optional[str] = None):
+    query = select(CustomerModel).order_by(CustomerModel.company_name).limit(limit)
+    if status is not None:
+        query = query.where(CustomerModel.status == status)
+    if customer_type is not None:
+        query = query.where(CustomerModel.customer_type == customer_type)
+    if after is not None:
+        query = query.where(CustomerModel.company_name > after)
+    return query
+
+def order_page_query(limit: int, after: Optional[int] = None, status: Optional[str] = None,
+                     customer_id: Optional[str] = None,
+                     date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                     min_amount: Optional[float] = None, max_amount: Optional[float] = None):
+    query = order_with_items_query().order_by(Order.id).limit(limit)
+    if status is not None:
+        query = query.where(Order.status == status)
+    if customer_id is not None:
+        query = query.where(Order.customer_id == customer_id)
+    if date_from is not None:
+        query = query.where(Order.order_date >= date_from)
+    if date_to is not None:
+        query = query.where(Order.order_date < date_to)
+    if min_amount is not None:
+        query = query.where(Order.total_amount >= min_amount)
+    if max_amount is not None:
+        query = query.where(Order.total_amount <= max_amount)
+    if after is not None:
+        query = query.where(Order.id > after)
+    return query
+
 # Define the customer endpoints
 @router.post("/customers/", status_code=201)
+@run_on_db_executor
 def create_customer(customer: Customer, db: Session = Depends(get_db)):
-    db_customer = CustomerModel(**customer.dict())
-    db.add(db_customer)
-    db.commit()
+    def insert_customer(session: Session) -> None:
+        session.add(CustomerModel(**customer.dict()))
+        session.flush()
+
+    run_write(db, insert_customer)
+    invalidate_customers([customer.company_name])
     return {"message": "Customer created successfully"}
 
-@router.post("/customers/batch", status_code=201)
-def create_customers_batch(customers: List[Customer], db: Session = Depends(get_db)):
-    existing_names = {cust.company_name for cust in db.query(CustomerModel).all()}
-    duplicates = [cust.company_name for cust in customers if cust.company_name in existing_names]
+# Upper bound on bound parameters per IN probe (SQLite allows 32766 variables per statement)
+DUPLICATE_PROBE_CHUNK_SIZE = 1000
+
+def find_existing_company_names(db: Session, company_names: List[str]) -> set:
+    """Return the subset of company_names already present, using an indexed IN probe."""
+    existing = set()
+    for start in range(0, len(company_names), DUPLICATE_PROBE_CHUNK_SIZE):
+        chunk = company_names[start:start + DUPLICATE_PROBE_CHUNK_SIZE]
+        existing.update(
+            db.scalars(select(CustomerModel.company_name).where(CustomerModel.company_name.in_(chunk)))
+        )
+    return existing
+
+def insert_customers(session: Session, customers: List[Customer]) -> List[str]:
+    """Insert a batch of new customers and return their company names, rejecting duplicates."""
+    company_names = [cust.company_name for cust in customers]
+    seen, repeated = set(), set()
+    for name in company_names:
+        (repeated if name in seen else seen).add(name)
+    existing_names = find_existing_company_names(session, list(seen))
+    duplicates = [name for name in company_names if name in existing_names or name in repeated]
     if duplicates:
         raise HTTPException(
             status_code=400,
-            detail=f"Duplicate company names found: {', '.join(duplicates)}"
+            detail=f"Duplicate company names found: {', '.join(dict.fromkeys(duplicates))}"
         )
-    db_customers = [CustomerModel(**cust.dict()) for cust in customers]
-    db.add_all(db_customers)
-    db.commit()
-    return {"message": f"{len(customers)} customers created successfully"}
+
+    # Core executemany insert; RETURNING is used where the dialect supports it for executemany (Postgres)
+    rows = [cust.dict() for cust in customers]
+    stmt = insert(CustomerModel.__table__)
+    if rows and session.get_bind().dialect.insert_executemany_returning:
+        stmt = stmt.returning(CustomerModel.__table__.c.company_name, sort_by_parameter_order=True)
+        return list(session.scalars(stmt, rows))
+    if rows:
+        session.execute(stmt, rows)
+    return company_names
+
+@router.post("/customers/batch", status_code=201)
+@run_on_db_executor
+def create_customers_batch(customers: List[Customer], db: Session = Depends(get_db)):
+    created = run_write(db, lambda session: insert_customers(session, customers))
+    invalidate_customers(created)
+    return {"message": f"{len(created)} customers created successfully", "company_names": created}
+
+def lookup_response(keys: list, found: dict) -> FastJSONResponse:
+    """Multi-get body: every requested key maps to its record, or to null with the key listed in not_found.
+
+    Keys are strings in both places, since JSON object keys are (order ids included).
+    """
+    return FastJSONResponse({
+        "results": {str(key): found.get(key) for key in keys},
+        "not_found": [str(key) for key in keys if key not in found],
+    })
+
+@router.post("/customers/lookup")
+@run_on_db_executor
+def lookup_customers(lookup: CustomerLookup, db: Session = Depends(get_db)):
+    company_names = list(dict.fromkeys(lookup.company_names))
+    found = {}
+    if customer_cache is not None:
+        for name in company_names:
+            cached = customer_cache.peek(name)
+            if cached is not MISSING:
+                found[name] = cached
+
+    missing = [name for name in company_names if name not in found]
+    if missing:
+        for customer in db.scalars(select(CustomerModel).where(CustomerModel.company_name.in_(missing))):
+            found[customer.company_name] = serialize_customer(customer)
+            if customer_cache is not None:
+                customer_cache.put(customer.company_name, found[customer.company_name])
+
+    return lookup_response(company_names, found)
 
 @router.get("/customers/{company_name}")
-def get_customer(company_name: str, db: Session = Depends(get_db)):
-    customer = db.query(CustomerModel).filter(CustomerModel.company_name == company_name).first()
+@run_on_db_executor
+def get_customer(company_name: str, request: Request, fields: Optional[str] = None,
+                 db: Session = Depends(get_db)):
+    projection = parse_fields(fields, CUSTOMER_FIELDS)
+    if has_conditional_headers(request):
+        # Version-only probe: a matching validator is answered without loading the record
+        current = db.execute(
+            select(CustomerModel.version, CustomerModel.updated_at).where(CustomerModel.company_name == company_name)
+        ).first()
+        if current and is_not_modified(request, *current):
+            return Response(status_code=304, headers=validator_headers(*current))
+
+    if projection is not None:
+        # A cached full record is projected in memory; otherwise only the requested columns are loaded
+        cached = customer_cache.peek(company_name) if customer_cache else MISSING
+        if cached is not MISSING:
+            body = {field: cached[field] for field in projection}
+            return FastJSONResponse(body, headers=validator_headers(cached["version"], cached["updated_at"]))
+        customer = db.scalars(
+            select(CustomerModel)
+            .options(load_only_fields(CustomerModel, projection))
+            .where(CustomerModel.company_name == company_name)
+        ).first()
+        if not customer:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        body = record_serializer(projection)(customer)
+        return FastJSONResponse(body, headers=validator_headers(customer.version, customer.updated_at))
+
+    def query_customer(key: str) -> Optional[dict]:
+        customer = db.query(CustomerModel).filter(CustomerModel.company_name == key).first()
+        return serialize_customer(customer) if customer else None
+
+    def load_customer(key: str) -> Optional[dict]:
+        return customer_flight.do(key, lambda: query_customer(key))
+
+    customer = customer_cache.get(company_name, load_customer) if customer_cache else load_customer(company_name)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
-    return customer
+    return FastJSONResponse(customer, headers=validator_headers(customer["version"], customer["updated_at"]))
 
 @router.get("/customers/")
-def list_customers(db: Session = Depends(get_db)):
-    return db.query(CustomerModel).all()
+@run_on_db_executor
+def list_customers(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    status: Optional[str] = None,
+    customer_type: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    projection = parse_fields(fields, CUSTOMER_FIELDS) or CUSTOMER_FIELDS
+    query = customer_page_query(limit, after, status, customer_type)
+    if projection != CUSTOMER_FIELDS:
+        query = query.options(load_only_fields(CustomerModel, projection))
+    customers = db.scalars(query).all()
+    serialize = record_serializer(projection)
+    response = FastJSONResponse([serialize(customer) for customer in customers])
+    set_next_cursor(response, customers, "company_name", limit)
+    return response
 
 @router.put("/customers/{company_name}/status")
-def update_customer_status(company_name: str, update: StatusUpdate, db: Session = Depends(get_db)):
-    customer = db.query(CustomerModel).filter(CustomerModel.company_name == company_name).first()
-    if not customer:
-        raise HTTPException(status_code=404, detail="Customer not found")
-    customer.status = update.status
-    db.commit()
+@run_on_db_executor
+def update_customer_status(company_name: str, update: StatusUpdate, db: Session = Depends(get_db),
+                           if_match: Optional[str] = Header(None)):
+    def set_status(session: Session) -> None:
+        customer = session.query(CustomerModel).filter(CustomerModel.company_name == company_name).first()
+        if not customer:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        if if_match is not None and not if_match_satisfied(if_match, customer.version):
+            raise write_conflict(412)
+        customer.status = update.status
+        session.flush()
+
+    run_write(db, set_status, conflict_status=412 if if_match is not None else 409)
+    invalidate_customers([company_name])
     return {"message": "Status updated successfully"}
 
 @router.get("/customers/pending/")
-def get_pending_customers(db: Session = Depends(get_db)):
-    return db.query(CustomerModel).filter(CustomerModel.status == "pending").all()
+@run_on_db_executor
+def get_pending_customers(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    customer_type: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    customers = db.scalars(customer_page_query(limit, after, "pending", customer_type)).all()
+    response = FastJSONResponse([serialize_customer(customer) for customer in customers])
+    set_next_cursor(response, customers, "company_name", limit)
+    return response
 
 # Define the order endpoints
-@router.post("/orders/", response_model=OrderResponse)
-async def create_order(order: OrderCreate, db: Session = Depends(get_db)):
-    # Calculate total amount
-    total_amount = sum(item.quantity * item.unit_price for item in order.items)
-    
-    # Create the Order object
-    db_order = Order(
-        customer_id=order.customer_id,
-        total_amount=total_amount,
-        status="pending"
-    )
-    db.add(db_order)
-    db.flush()  # Flush to get the order ID
-    
-    # Create OrderItem objects
-    db_items = []
-    for item in order.items:
-        db_item = OrderItem(
-            order_id=db_order.id,
-            product_name=item.product_name,
-            quantity=item.quantity,
-            unit_price=item.unit_price
+@router.post("/orders/", response_model=OrderResponse, status_code=201)
+async def create_order(order: OrderCreate, request: Request, db: AsyncSession = Depends(get_async_db),
+                       idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_KEY_HEADER)):
+    if idempotency_key is not None:
+        fingerprint = request_fingerprint(request.method, request.url.path, order)
+        replay = await find_idempotent_response(db, idempotency_key, fingerprint)
+        if replay is not None:
+            return replay
+
+    def insert_order(session: Session) -> dict:
+        # Calculate total amount
+        total_amount = sum(item.quantity * item.unit_price for item in order.items)
+
+        # Create the Order object together with its OrderItem objects
+        db_order = Order(
+            customer_id=order.customer_id,
+            total_amount=total_amount,
+            status="pending",
+            items=[
+                OrderItem(
+                    product_name=item.product_name,
+                    quantity=item.quantity,
+                    unit_price=item.unit_price
+                )
+                for item in order.items
+            ]
         )
-        db.add(db_item)
-        db_items.append(db_item)
-    
-    db.commit()
-    db.refresh(db_order)
-
-    # Serialize the items into dictionaries
-    serialized_items = [
-        {
-            "product_name": item.product_name,
-            "quantity": item.quantity,
-            "unit_price": item.unit_price
-        }
-        for item in db_items
-    ]
+        session.add(db_order)
+        session.flush()
+        body = serialize_order(db_order)
+        if idempotency_key is not None:
+            save_idempotent_response(session, idempotency_key, fingerprint, 201, body)
+        return body
+
+    # Runs on this session through run_sync, or in the group-commit writer when it is enabled
+    try:
+        body = await run_write_async(db, insert_order)
+    except IntegrityError:
+        if idempotency_key is None:
+            raise
+        # A concurrent request with the same key committed first: answer with its response
+        await db.rollback()
+        replay = await find_idempotent_response(db, idempotency_key, fingerprint)
+        if replay is None:
+            raise
+        return replay
+    return FastJSONResponse(body, status_code=201)
 
-    # Return the response
-    return {
-        "id": db_order.id,
-        "customer_id": db_order.customer_id,
-        "order_date": db_order.order_date,
-        "total_amount": db_order.total_amount,
-        "status": db_order.status,
-        "items": serialized_items
-    }
+@router.post("/orders/lookup")
+async def lookup_orders(lookup: OrderLookup, db: AsyncSession = Depends(get_async_db)):
+    order_ids = list(dict.fromkeys(lookup.order_ids))
+    # One IN query for the orders, one more for all of their items
+    result = await db.execute(order_with_items_query().where(Order.id.in_(order_ids)))
+    found = {order.id: serialize_order(order) for order in result.scalars()}
+    return lookup_response(order_ids, found)
 
 @router.get("/orders/{order_id}", response_model=OrderResponse)
-async def get_order(order_id: int, db: Session = Depends(get_db)):
-    order = db.query(Order).filter(Order.id == order_id).first()
+async def get_order(order_id: int, request: Request, fields: Optional[str] = None,
+                    db: AsyncSession = Depends(get_async_db)):
+    projection = parse_fields(fields, ORDER_FIELDS + ("items",)) or ORDER_FIELDS + ("items",)
+    if has_conditional_headers(request):
+        # Version-only probe: a matching validator is answered without loading the order and its items
+        current = (await db.execute(select(Order.version, Order.updated_at).where(Order.id == order_id))).first()
+        if current and is_not_modified(request, *current):
+            return Response(status_code=304, headers=validator_headers(*current))
+
+    async def query_order() -> Optional[Tuple[dict, dict]]:
+        query = select(Order).where(Order.id == order_id)
+        if "items" in projection:
+            query = query.options(ORDER_ITEMS_LOADER)
+        if projection[:len(ORDER_FIELDS)] != ORDER_FIELDS:
+            query = query.options(load_only_fields(Order, [field for field in projection if field != "items"]))
+        order = (await db.execute(query)).scalars().first()
+        if not order:
+            return None
+        return serialize_order(order, projection), validator_headers(order.version, order.updated_at)
+
+    order = await order_flight.do((order_id, projection), query_order)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-    
-    # Serialize the items into dictionaries
-    serialized_items = [
+
+    body, headers = order
+    return FastJSONResponse(body, headers=headers)
+
+@router.get("/orders/", response_model=List[OrderResponse])
+async def list_orders(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    status: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    result = await db.execute(order_page_query(
+        limit, after, status, customer_id, date_from, date_to, min_amount, max_amount
+    ))
+    orders = result.scalars().all()
+    response = FastJSONResponse([serialize_order(order) for order in orders])
+    set_next_cursor(response, orders, "id", limit)
+    return response
+
+# Number of NDJSON rows written per executemany transaction by /orders/batch
+ORDER_BATCH_CHUNK_SIZE = 500
+
+async def iter_ndjson_lines(request: Request) -> AsyncIterator[Tuple[int, bytes]]:
+    """Yield (line_number, line) pairs from a streamed NDJSON request body, skipping blank lines."""
+    buffer = b""
+    line_number = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+    if buffer.strip():
+        yield line_number + 1, buffer
+
+async def insert_order_rows(db: AsyncSession, rows: List[Tuple[int, OrderCreate]]) -> List[dict]:
+    """Insert orders and their items with two executemany statements, without committing."""
+    orders_table = Order.__table__
+    order_rows = [
         {
+            "customer_id": order.customer_id,
+            "total_amount": sum(item.quantity * item.unit_price for item in order.items),
+            "status": "pending"
+        }
+        for _, order in rows
+    ]
+
+    if db.get_bind().dialect.insert_executemany_returning:
+        result = await db.execute(
+            insert(orders_table).returning(orders_table.c.id, sort_by_parameter_order=True),
+            order_rows
+        )
+        order_ids = list(result.scalars())
+    else:
+        order_ids = [
+            (await db.execute(insert(orders_table), order_row)).inserted_primary_key[0]
+            for order_row in order_rows
+        ]
+
+    item_rows = [
+        {
+            "order_id": order_id,
             "product_name": item.product_name,
             "quantity": item.quantity,
             "unit_price": item.unit_price
         }
+        for order_id, (_, order) in zip(order_ids, rows)
         for item in order.items
     ]
+    if item_rows:
+        await db.execute(insert(OrderItem.__table__), item_rows)
+
+    return [
+        {"line": line_number, "result": "created", "id": order_id, "total_amount": order_row["total_amount"]}
+        for (line_number, _), order_id, order_row in zip(rows, order_ids, order_rows)
+    ]
+
+async def write_order_chunk(db: AsyncSession, rows: List[Tuple[int, OrderCreate]]) -> List[dict]:
+    """Insert a chunk of orders in one transaction; any failing row fails the whole chunk."""
+    await begin_write_async(db)
+    results = await insert_order_rows(db, rows)
+    await db.commit()
+    return results
+
+async def write_order_rows(db: AsyncSession, rows: List[Tuple[int, OrderCreate]]) -> List[dict]:
+    """Insert orders one by one, each in its own SAVEPOINT, so that a bad row only fails itself."""
+    await begin_write_async(db)
+    results = []
+    for line_number, order in rows:
+        try:
+            async with db.begin_nested():
+                results.extend(await insert_order_rows(db, [(line_number, order)]))
+        except SQLAlchemyError as exc:
+            results.append({"line": line_number, "result": "error", "detail": str(exc)})
+    await db.commit()
+    return results
+
+async def ingest_orders(request: Request, db: AsyncSession) -> AsyncIterator[bytes]:
+    """Validate NDJSON orders as they arrive and stream one result line per input row."""
+    pending: List[Tuple[int, OrderCreate]] = []
+
+    async def flush(rows: List[Tuple[int, OrderCreate]]) -> bytes:
+        try:
+            results = await write_order_chunk(db, rows)
+        except SQLAlchemyError:
+            await db.rollback()
+            # Retry the chunk row by row, so the report only names the rows that actually failed
+            try:
+                results = await write_order_rows(db, rows)
+            except SQLAlchemyError as exc:
+                await db.rollback()
+                results = [{"line": line_number, "result": "error", "detail": str(exc)} for line_number, _ in rows]
+        return "".join(json.dumps(result) + "\n" for result in results).encode()
+
+    try:
+        async for line_number, line in iter_ndjson_lines(request):
+            try:
+                pending.append((line_number, OrderCreate.parse_raw(line)))
+            except ValidationError as exc:
+                error = {"line": line_number, "result": "error", "detail": exc.errors()}
+                yield (json.dumps(error, default=str) + "\n").encode()
+                continue
+
+            if len(pending) >= ORDER_BATCH_CHUNK_SIZE:
+                yield await flush(pending)
+                pending = []
+    except ClientDisconnect:
+        # The client went away while still sending: nobody will read the remaining results
+        return
+
+    # Polling for a disconnect is only safe once the body is exhausted, since it consumes a message
+    if pending and not await request.is_disconnected():
+        yield await flush(pending)
+
+class DuplexStreamingResponse(StreamingResponse):
+    """StreamingResponse that leaves `receive` to the body iterator.
+
+    StreamingResponse normally consumes request messages to watch for a disconnect, which
+    would swallow the request body that ingest_orders is still reading.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
 
-    # Return the response
-    return {
-        "id": order.id,
-        "customer_id": order.customer_id,
-        "order_date": order.order_date,
-        "total_amount": order.total_amount,
-        "status": order.status,
-        "items": serialized_items
-    }
\ No newline at end of file
+# Result lines are written while the upload is still being read; buffering them up to the
+# compression threshold would hold results back from the client
+@router.post("/orders/batch", status_code=200, dependencies=[Depends(no_compression)])
+async def create_orders_batch(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Bulk order ingestion: one OrderCreate JSON document per line in, one result per line out."""
+    # The session is used after the handler returns; FastAPI 0.104 closes yield dependencies only
+    # once the response has been sent, and a closed AsyncSession reconnects on next use anyway.
+    return DuplexStreamingResponse(ingest_orders(request, db), media_type="application/x-ndjson")
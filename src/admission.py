@@ -0,0 +1,172 @@
+"""Admission control: a concurrency limit with prioritized, bounded queueing and load shedding.
+
+At most `max_concurrency` requests run at once. Further requests wait in a queue ordered by
+priority (then arrival), so order writes are admitted ahead of list and export reads. When
+the queue is full, or a request has waited longer than the queue timeout, the request is
+shed with a fast 503 and a Retry-After header instead of piling onto an exhausted DB pool;
+a full queue makes room for a higher-priority arrival by shedding its lowest-priority waiter.
+
+Exempt paths (the metrics scrape and the admin endpoints, in main.py) bypass the controller
+entirely: they are the tools needed to look at an overloaded server.
+
+All state is touched from the event loop only, so no locks are needed.
+
+Configured through the environment:
+
+    ADMISSION_CONTROL             set to 0 to disable the middleware (default: 1)
+    ADMISSION_MAX_CONCURRENCY     requests processed at once (default: 64)
+    ADMISSION_MAX_QUEUE           requests allowed to wait for a slot (default: 128)
+    ADMISSION_QUEUE_TIMEOUT_MS    longest wait for a slot before shedding (default: 5000)
+    ADMISSION_RETRY_AFTER         Retry-After seconds sent with a 503 (default: 1)
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from typing import Iterable, List, Optional, Tuple
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+# (method, path, priority); a path ending in "*" matches by prefix. The first match wins.
+PriorityRule = Tuple[str, str, int]
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int = 64, max_queue: int = 128, queue_timeout: float = 5.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.admitted = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.shed = {name: 0 for name in PRIORITY_NAMES.values()}
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    @classmethod
+    def from_env(cls) -> Optional["AdmissionController"]:
+        if os.getenv("ADMISSION_CONTROL", "1") != "1":
+            return None
+        return cls(
+            max_concurrency=int(os.getenv("ADMISSION_MAX_CONCURRENCY", 64)),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", 128)),
+            queue_timeout=int(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", 5000)) / 1000,
+        )
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, priority: int = NORMAL) -> bool:
+        """Wait for a slot; False means the request was shed and must not run."""
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self.in_flight += 1
+            return self._admit(priority)
+
+        if len(self._waiters) >= self.max_queue:
+            lowest = max(self._waiters, default=None)
+            if lowest is None or lowest[0] <= priority:
+                return self._shed(priority)
+            self._remove(lowest)
+            lowest[2].set_result(False)
+
+        entry = (priority, next(self._sequence), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, entry)
+        future = entry[2]
+        try:
+            await asyncio.wait((future,), timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # Client went away while queued; hand back a slot that was granted meanwhile
+            if future.done() and future.result():
+                self.release()
+            else:
+                self._remove(entry)
+                future.cancel()
+            raise
+
+        if not future.done():
+            self._remove(entry)
+            future.cancel()
+            return self._shed(priority)
+        return self._admit(priority) if future.result() else self._shed(priority)
+
+    def release(self) -> None:
+        """Free a slot, passing it straight to the highest-priority waiter if there is one."""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(True)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": dict(self.admitted),
+            "shed": dict(self.shed),
+        }
+
+    def _admit(self, priority: int) -> bool:
+        self.admitted[PRIORITY_NAMES[priority]] += 1
+        return True
+
+    def _shed(self, priority: int) -> bool:
+        self.shed[PRIORITY_NAMES[priority]] += 1
+        return False
+
+    def _remove(self, entry) -> None:
+        try:
+            self._waiters.remove(entry)
+        except ValueError:
+            return
+        heapq.heapify(self._waiters)
+
+
+def _path_matches(path: str, pattern: str) -> bool:
+    """Exact match, or prefix match for a pattern ending in `*`."""
+    return path == pattern or (pattern.endswith("*") and path.startswith(pattern[:-1]))
+
+
+class AdmissionMiddleware:
+    def __init__(self, app: ASGIApp, controller: AdmissionController,
+                 rules: Iterable[PriorityRule] = (), retry_after: int = 1, exempt_paths: Iterable[str] = ()):
+        self.app = app
+        self.controller = controller
+        self.rules = list(rules)
+        self.retry_after = retry_after
+        self.exempt_paths = list(exempt_paths)
+
+    def priority_for(self, scope: Scope) -> int:
+        method, path = scope["method"], scope["path"]
+        for rule_method, rule_path, priority in self.rules:
+            if rule_method == method and _path_matches(path, rule_path):
+                return priority
+        return NORMAL
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or any(_path_matches(scope["path"], path) for path in self.exempt_paths):
+            await self.app(scope, receive, send)
+            return
+
+        priority = self.priority_for(scope)
+        if not await self.controller.acquire(priority):
+            logger.debug("Shed %s %s (priority %s)", scope["method"], scope["path"], PRIORITY_NAMES[priority])
+            response = JSONResponse(
+                {"detail": "Server is overloaded, retry later"},
+                status_code=503,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
@@ -0,0 +1,225 @@
+"""Read-through record cache with LRU + TTL eviction and pluggable backends.
+
+Customer records are read far more often than they change, so get_customer serves them
+from a RecordCache and every write path invalidates the keys it touched. Two backends
+ship with the module: MemoryBackend (per process) and DiskBackend (a local SQLite file
+that survives restarts and can be shared by the workers of one host).
+
+An invalidation only reaches the backend of the process that made the write, so pre-forked
+workers (WEB_CONCURRENCY > 1) share the disk backend by default: with per-process memory
+caches, the other workers would serve the old record until its TTL runs out.
+
+Configured through the environment:
+
+    CUSTOMER_CACHE_BACKEND  memory, disk or none (default: memory, disk with several workers)
+    CUSTOMER_CACHE_SIZE     maximum number of records (default: 10000)
+    CUSTOMER_CACHE_TTL      seconds a record stays fresh (default: 300)
+    CUSTOMER_CACHE_PATH     file used by the disk backend (default: ./data/customer_cache.db)
+"""
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+def worker_count() -> int:
+    """Worker processes serving the app, as set by src.server (and read by uvicorn --workers)."""
+    return int(os.getenv("WEB_CONCURRENCY", 1))
+
+
+class CacheBackend:
+    """Storage interface used by RecordCache.
+
+    `get` returns MISSING for absent or expired keys; `set` returns how many entries
+    were evicted to make room.
+    """
+
+    def get(self, key: str) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any) -> int:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, max_size: int = 10000, ttl: float = 300, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> int:
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskBackend(CacheBackend):
+    def __init__(self, path: str, max_size: int = 10000, ttl: float = 300, clock: Callable[[], float] = time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_accessed_at ON cache (accessed_at)")
+
+    def get(self, key: str) -> Any:
+        now = self.clock()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return MISSING
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return MISSING
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return pickle.loads(row[0])
+
+    def set(self, key: str, value: Any) -> int:
+        now = self.clock()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, pickle.dumps(value), now + self.ttl, now),
+            )
+            overflow = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_size
+            if overflow <= 0:
+                return 0
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            )
+            return overflow
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class RecordCache:
+    """Read-through cache in front of a backend, with hit/miss/eviction counters."""
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls, prefix: str) -> Optional["RecordCache"]:
+        workers = worker_count()
+        kind = os.getenv(f"{prefix}_BACKEND", "disk" if workers > 1 else "memory")
+        if kind == "memory" and workers > 1:
+            logger.warning("%s_BACKEND=memory with %d workers: a write only invalidates the cache of "
+                           "the worker that made it, the others serve stale records", prefix, workers)
+        max_size = int(os.getenv(f"{prefix}_SIZE", 10000))
+        ttl = float(os.getenv(f"{prefix}_TTL", 300))
+        if kind == "none":
+            return None
+        if kind == "disk":
+            path = os.getenv(f"{prefix}_PATH", f"./data/{prefix.lower()}.db")
+            return cls(DiskBackend(path, max_size=max_size, ttl=ttl))
+        return cls(MemoryBackend(max_size=max_size, ttl=ttl))
+
+    def get(self, key: str, load: Callable[[str], Any]) -> Any:
+        """Return the cached value for key, calling `load(key)` on a miss; None results are not cached."""
+        value = self.backend.get(key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = load(key)
+        if value is not None:
+            self.evictions += self.backend.set(key, value)
+        return value
+
+    def peek(self, key: str) -> Any:
+        """Return the cached value or MISSING, without loading; a MISSING result counts as a miss."""
+        value = self.backend.get(key)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        self.evictions += self.backend.set(key, value)
+
+    def invalidate(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            self.backend.delete(key)
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "size": len(self.backend),
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
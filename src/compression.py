@@ -0,0 +1,223 @@
+"""Response compression middleware (gzip, plus brotli when the `brotli` package is installed).
+
+Bodies smaller than the minimum size are sent as-is. Streaming responses (such as the
+exports) are buffered only until they cross the threshold and are then compressed chunk
+by chunk with a sync flush, so clients still receive data progressively.
+
+The coding is negotiated from Accept-Encoding, q-values included (q=0 refuses a coding), and
+every response that could be compressed carries `Vary: Accept-Encoding`. A compressed body is
+a different representation, so its ETag gets a `-gzip`/`-br` suffix; the suffix is stripped
+from If-None-Match and If-Match before the request reaches the app, which keeps comparing
+its own tags.
+
+A route opts out with `dependencies=[Depends(no_compression)]`; whole path prefixes can be
+excluded through the environment:
+
+    COMPRESSION_ENABLED        set to 0 to disable the middleware (default: 1)
+    COMPRESSION_MIN_SIZE       smallest body, in bytes, that gets compressed (default: 500)
+    COMPRESSION_GZIP_LEVEL     zlib compression level (default: 6)
+    COMPRESSION_BROTLI_QUALITY brotli quality (default: 4)
+    COMPRESSION_EXCLUDE_PATHS  comma-separated path prefixes that are never compressed
+"""
+import os
+import re
+import zlib
+from typing import Dict, Iterable, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+# Scope key set by no_compression() and read by the middleware once the response starts
+DISABLED_SCOPE_KEY = "compression.disabled"
+
+# Entity-tag suffix of a compressed representation, e.g. "3" -> "3-gzip"
+_ETAG_SUFFIX = re.compile(rb'-(?:gzip|br)"')
+_CONDITIONAL_HEADERS = (b"if-none-match", b"if-match")
+
+
+def no_compression(request: Request) -> None:
+    """Route dependency that disables compression for the route's responses."""
+    request.scope[DISABLED_SCOPE_KEY] = True
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """Content codings of an Accept-Encoding header with their q-values (RFC 9110 12.5.3)."""
+    codings = {}
+    for part in header.split(","):
+        coding, *params = [item.strip() for item in part.split(";")]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding.lower()] = q
+    return codings
+
+
+def _strip_etag_suffixes(scope: Scope) -> Scope:
+    headers = scope["headers"]
+    if not any(name in _CONDITIONAL_HEADERS for name, _ in headers):
+        return scope
+    return {**scope, "headers": [
+        (name, _ETAG_SUFFIX.sub(b'"', value) if name in _CONDITIONAL_HEADERS else value)
+        for name, value in headers
+    ]}
+
+
+class _GzipCompressor:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 500, gzip_level: int = 6,
+                 brotli_quality: int = 4, exclude_paths: Iterable[str] = ()):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.exclude_paths = tuple(exclude_paths)
+
+    @staticmethod
+    def settings_from_env() -> Optional[dict]:
+        """Keyword arguments for add_middleware, or None when compression is disabled."""
+        if os.getenv("COMPRESSION_ENABLED", "1") != "1":
+            return None
+        excluded = os.getenv("COMPRESSION_EXCLUDE_PATHS", "")
+        return {
+            "minimum_size": int(os.getenv("COMPRESSION_MIN_SIZE", 500)),
+            "gzip_level": int(os.getenv("COMPRESSION_GZIP_LEVEL", 6)),
+            "brotli_quality": int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4)),
+            "exclude_paths": [path.strip() for path in excluded.split(",") if path.strip()],
+        }
+
+    def _choose_encoding(self, scope: Scope) -> Optional[str]:
+        accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        wildcard = accepted.get("*", 0.0)
+        # Highest q-value wins, brotli on a tie; a coding that is not listed takes the q of "*"
+        candidates = ("br", "gzip") if brotli is not None else ("gzip",)
+        best, best_q = None, 0.0
+        for coding in candidates:
+            q = accepted.get(coding, wildcard)
+            if q > best_q:
+                best, best_q = coding, q
+        return best
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+        await _CompressionResponder(self, _strip_etag_suffixes(scope), self._choose_encoding(scope), send).run(receive)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, scope: Scope, encoding: Optional[str], send: Send):
+        self.middleware = middleware
+        self.scope = scope
+        self.encoding = encoding
+        self.send = send
+        self.start_message: Optional[Message] = None
+        self.buffer = []
+        self.buffered = 0
+        self.compressor = None
+        self.passthrough = False
+
+    async def run(self, receive: Receive) -> None:
+        await self.middleware.app(self.scope, receive, self.send_wrapper)
+
+    def _new_compressor(self):
+        if self.encoding == "br":
+            return _BrotliCompressor(self.middleware.brotli_quality)
+        return _GzipCompressor(self.middleware.gzip_level)
+
+    async def send_wrapper(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            headers = MutableHeaders(raw=message["headers"])
+            disabled = self.scope.get(DISABLED_SCOPE_KEY, False)
+            if not disabled:
+                # The body could be compressed for another client, so caches must key on the coding
+                headers.add_vary_header("Accept-Encoding")
+            self.passthrough = (
+                disabled
+                or self.encoding is None
+                or "content-encoding" in headers
+                or message["status"] in (204, 304)
+            )
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        if self.passthrough:
+            if self.start_message is not None:
+                await self.send(self.start_message)
+                self.start_message = None
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is not None:
+            # Already streaming compressed output
+            data = self.compressor.compress(body) if more_body else self.compressor.finish(body)
+            await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+            return
+
+        self.buffer.append(body)
+        self.buffered += len(body)
+        if more_body and self.buffered < self.middleware.minimum_size:
+            return
+
+        payload = b"".join(self.buffer)
+        self.buffer = []
+        headers = MutableHeaders(raw=self.start_message["headers"])
+
+        if self.buffered < self.middleware.minimum_size:
+            # The whole body arrived and is too small to be worth compressing
+            await self.send(self.start_message)
+            await self.send({"type": "http.response.body", "body": payload, "more_body": False})
+            return
+
+        self.compressor = self._new_compressor()
+        headers["Content-Encoding"] = self.encoding
+        etag = headers.get("ETag")
+        if etag is not None and etag.endswith('"'):
+            headers["ETag"] = f'{etag[:-1]}-{self.encoding}"'
+        if more_body:
+            del headers["Content-Length"]
+            data = self.compressor.compress(payload)
+        else:
+            data = self.compressor.finish(payload)
+            headers["Content-Length"] = str(len(data))
+        await self.send(self.start_message)
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
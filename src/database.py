@@ -1,22 +1,21 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from src.engine import create_db_engine
 from src.models import Base
 
 load_dotenv()
 
-# SQLite database URL
-DATABASE_URL = "sqlite:///./test.db"
-
-# Create the database engine
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Create the database engine (configured through DATABASE_URL and the DB_* settings);
+# no connection is opened until the first session needs one
+engine = create_db_engine()
 
 # Create a session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Create the database tables
-Base.metadata.create_all(bind=engine)
+# Create the database tables (at startup, not at import)
+def init_db():
+    Base.metadata.create_all(bind=engine)
 
 # Dependency to get the database session
 def get_db():
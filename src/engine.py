@@ -0,0 +1,150 @@
+"""Engine factory shared by the application and the migrations.
+
+Everything is driven by environment variables so each deployment can tune connection
+behaviour without code changes:
+
+    DATABASE_URL            sync SQLAlchemy URL (default: sqlite:///./data/test.db)
+    DB_POOL_SIZE            connections kept open in the pool (default: 5)
+    DB_MAX_OVERFLOW         extra connections allowed above the pool size (default: 10)
+    DB_POOL_RECYCLE         seconds after which a connection is replaced (default: 1800)
+    DB_POOL_TIMEOUT         seconds to wait for a free connection (default: 30)
+    DB_POOL_PRE_PING        set to 1 to test connections on checkout, 0 to skip it
+                            (default: 1, except SQLite, whose connections cannot go stale)
+    DB_STATEMENT_TIMEOUT_MS Postgres statement_timeout, 0 disables it (default: 0)
+    SQLITE_BUSY_TIMEOUT_MS  how long SQLite waits on a locked database (default: 5000)
+    SQLITE_MMAP_SIZE        PRAGMA mmap_size in bytes (default: 268435456)
+    SQLITE_CACHE_SIZE       PRAGMA cache_size, negative values are KiB (default: -65536)
+"""
+import os
+from typing import Optional
+
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.engine import Engine, URL
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+
+DEFAULT_DATABASE_URL = "sqlite:///./data/test.db"
+
+# Async drivers used for the same database by the async session layer
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+def get_database_url() -> str:
+    return os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL)
+
+
+def is_sqlite(url) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def to_async_url(url) -> URL:
+    """Return the URL of the same database addressed through its async driver."""
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def _pool_options(url: URL) -> dict:
+    # In-memory SQLite uses a per-thread singleton pool that takes none of these settings
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "pool_size": _env_int("DB_POOL_SIZE", 5),
+        "max_overflow": _env_int("DB_MAX_OVERFLOW", 10),
+        "pool_recycle": _env_int("DB_POOL_RECYCLE", 1800),
+        "pool_timeout": _env_int("DB_POOL_TIMEOUT", 30),
+        # A ping is a round trip on every checkout; only server connections can be dropped under us
+        "pool_pre_ping": _env_int("DB_POOL_PRE_PING", 0 if url.get_backend_name() == "sqlite" else 1) == 1,
+    }
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    # Leave transaction control to SQLAlchemy (see _begin_sqlite_transaction)
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={_env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)}")
+    cursor.execute(f"PRAGMA mmap_size={_env_int('SQLITE_MMAP_SIZE', 268435456)}")
+    cursor.execute(f"PRAGMA cache_size={_env_int('SQLITE_CACHE_SIZE', -65536)}")
+    cursor.close()
+
+
+# Execution options of a connection that is going to write: on SQLite its transaction takes
+# the write lock when it begins (BEGIN IMMEDIATE), other databases ignore them
+WRITE_TRANSACTION = {"sqlite_begin": "IMMEDIATE"}
+
+
+def _begin_sqlite_transaction(conn) -> None:
+    # pysqlite defers BEGIN until the first DML statement, so a SAVEPOINT issued first would
+    # open (and its RELEASE would commit) the outer transaction; emit BEGIN explicitly instead.
+    # Like COMMIT, it goes straight to the driver rather than through statement events.
+    # Writers begin IMMEDIATE: a deferred transaction that has read cannot be upgraded once
+    # another writer has committed, and SQLite fails it at once with "database is locked"
+    # (SQLITE_BUSY_SNAPSHOT) instead of waiting for busy_timeout.
+    mode = conn.get_execution_options().get("sqlite_begin", "DEFERRED")
+    cursor = conn.connection.cursor()
+    cursor.execute(f"BEGIN {mode}")
+    cursor.close()
+
+
+def _configure_sqlite(engine: Engine) -> None:
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
+    event.listen(engine, "begin", _begin_sqlite_transaction)
+
+
+def create_db_engine(url=None) -> Engine:
+    """Create the synchronous engine for `url` (default: DATABASE_URL)."""
+    url = make_url(url or get_database_url())
+    if url.get_backend_name() == "sqlite":
+        engine = create_engine(url, connect_args={"check_same_thread": False}, **_pool_options(url))
+        _configure_sqlite(engine)
+        return engine
+
+    connect_args = {}
+    statement_timeout = _env_int("DB_STATEMENT_TIMEOUT_MS", 0)
+    if statement_timeout and url.get_backend_name() == "postgresql":
+        connect_args["options"] = f"-c statement_timeout={statement_timeout}"
+    return create_engine(url, connect_args=connect_args, **_pool_options(url))
+
+
+def create_async_db_engine(url=None) -> AsyncEngine:
+    """Create the async engine for the database behind `url` (default: DATABASE_URL)."""
+    url = to_async_url(url or get_database_url())
+    if url.get_backend_name() == "sqlite":
+        options = _pool_options(url)
+        # Pooled like the sync engine, so the connect and its PRAGMAs are not paid per request
+        # (in-memory URLs take no pool settings and stay on NullPool). Every pooled aiosqlite
+        # connection keeps a non-daemon thread: dispose the engine before the process exits.
+        engine = create_async_engine(url, poolclass=AsyncAdaptedQueuePool if options else NullPool, **options)
+        _configure_sqlite(engine.sync_engine)
+        return engine
+
+    connect_args = {}
+    statement_timeout = _env_int("DB_STATEMENT_TIMEOUT_MS", 0)
+    if statement_timeout and url.get_backend_name() == "postgresql":
+        connect_args["server_settings"] = {"statement_timeout": str(statement_timeout)}
+    return create_async_engine(url, connect_args=connect_args, **_pool_options(url))
+
+
+def pool_status(engine) -> dict:
+    """Snapshot of an engine's connection pool, for health checks and metrics."""
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    # Only queue-style pools keep these counters
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    return status
+
+
+def pool_capacity(engine) -> Optional[int]:
+    """Most connections the engine's pool will hand out at once, or None if it is unbounded."""
+    pool = engine.pool
+    if not hasattr(pool, "size"):
+        return None
+    max_overflow = getattr(pool, "_max_overflow", 0)
+    return None if max_overflow < 0 else pool.size() + max_overflow
@@ -0,0 +1,131 @@
+"""Dedicated thread pool for DB-bound synchronous handlers.
+
+FastAPI runs plain `def` handlers on Starlette's shared threadpool (40 threads by default),
+whose size has nothing to do with the engine's connection pool: threads beyond the pool's
+capacity only block on checkout. Handlers decorated with `DBExecutor.handler` run on a pool
+sized to the engine's capacity instead, so excess requests wait in the executor queue (where
+the wait is measured) rather than on a connection.
+
+Configured through the environment:
+
+    DB_EXECUTOR          set to 0 to leave handlers on Starlette's threadpool (default: 1)
+    DB_EXECUTOR_WORKERS  worker threads (default: pool_size + max_overflow of the engine)
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from src.engine import pool_capacity
+from src.profiling import run_profiled
+
+# Used when the engine's pool does not bound its connections
+DEFAULT_WORKERS = 16
+
+
+class DBExecutor:
+    """Thread pool for sync handlers; without max_workers it is sized from `engine_factory()`
+    on first use, so the engine is not created at import."""
+
+    def __init__(self, max_workers: Optional[int] = None, engine_factory: Optional[Callable[[], Any]] = None,
+                 name: str = "db-executor"):
+        self.name = name
+        self._max_workers = max_workers
+        self._engine_factory = engine_factory
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, engine_factory: Callable[[], Any]) -> Optional["DBExecutor"]:
+        if os.getenv("DB_EXECUTOR", "1") != "1":
+            return None
+        workers = os.getenv("DB_EXECUTOR_WORKERS")
+        return cls(int(workers) if workers else None, engine_factory=engine_factory)
+
+    @property
+    def max_workers(self) -> int:
+        if self._max_workers is None:
+            capacity = pool_capacity(self._engine_factory()) if self._engine_factory is not None else None
+            self._max_workers = capacity or DEFAULT_WORKERS
+        return self._max_workers
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is not None:
+            return self._executor
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+            return self._executor
+
+    @property
+    def queue_depth(self) -> int:
+        return self.submitted - self.started
+
+    @property
+    def running(self) -> int:
+        return self.started - self.completed
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run `fn(*args, **kwargs)` on a worker thread, with the caller's contextvars."""
+        context = contextvars.copy_context()
+        submitted_at = time.perf_counter()
+        self.submitted += 1
+
+        def call():
+            wait = time.perf_counter() - submitted_at
+            with self._lock:
+                self.started += 1
+                self.wait_seconds_total += wait
+                self.wait_seconds_max = max(self.wait_seconds_max, wait)
+            try:
+                # run_profiled only profiles when the request is being profiled
+                return context.run(run_profiled, fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self.completed += 1
+
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), call)
+
+    def handler(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        """Turn a sync route handler into a coroutine that runs it on this executor.
+
+        functools.wraps keeps the signature visible to FastAPI, so parameters and
+        dependencies are resolved exactly as before.
+        """
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            return await self.run(fn, *args, **kwargs)
+        return wrapper
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "queue_depth": self.queue_depth,
+            "running": self.running,
+            "completed": self.completed,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+
+    def shutdown(self) -> None:
+        """Wait for running tasks and release the threads; the next run starts a fresh pool."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+def db_handler(executor: Optional[DBExecutor]) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Route decorator: run on `executor`, or leave the handler untouched when it is disabled."""
+    if executor is None:
+        return lambda fn: fn
+    return executor.handler
@@ -0,0 +1,114 @@
+"""Streaming CSV / NDJSON exports of the customers and orders tables.
+
+Rows are read through a server-side cursor (stream_results + yield_per) and written out
+one partition at a time, so an export holds at most EXPORT_CHUNK_SIZE rows in memory no
+matter how large the table is.
+"""
+import csv
+import io
+from datetime import datetime
+from typing import Iterator, Literal
+
+from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+from src.CustomerOnboarding import CUSTOMER_FIELDS, ITEM_FIELDS, ORDER_FIELDS, CustomerModel, Order, OrderItem, get_engine
+from src.responses import dumps
+
+# Rows fetched from the cursor, and written to the client, per chunk
+EXPORT_CHUNK_SIZE = 1000
+
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+router = APIRouter(
+    prefix="/api/export",
+    tags=["Export"]
+)
+
+
+def stream_rows(statement) -> Iterator[list]:
+    """Yield lists of at most EXPORT_CHUNK_SIZE rows from a server-side cursor."""
+    with get_engine().connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE).execute(statement)
+        yield from result.partitions()
+
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def to_csv(header, rows: Iterator[list]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for chunk in rows:
+        writer.writerows([_csv_value(value) for value in row] for row in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def customer_rows() -> Iterator[list]:
+    columns = [getattr(CustomerModel, field) for field in CUSTOMER_FIELDS]
+    return stream_rows(select(*columns).order_by(CustomerModel.company_name))
+
+
+def customers_ndjson() -> Iterator[bytes]:
+    for chunk in customer_rows():
+        yield b"".join(dumps(dict(zip(CUSTOMER_FIELDS, row))) + b"\n" for row in chunk)
+
+
+def order_item_rows() -> Iterator[list]:
+    """Orders left-joined with their items, one row per item, ordered so each order's rows are adjacent."""
+    columns = [getattr(Order, field) for field in ORDER_FIELDS] + [getattr(OrderItem, field) for field in ITEM_FIELDS]
+    statement = (
+        select(*columns)
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+        .order_by(Order.id, OrderItem.id)
+    )
+    return stream_rows(statement)
+
+
+def orders_ndjson() -> Iterator[bytes]:
+    order_width = len(ORDER_FIELDS)
+    current = None
+    for chunk in order_item_rows():
+        lines = []
+        for row in chunk:
+            if current is None or current["id"] != row[0]:
+                if current is not None:
+                    lines.append(dumps(current) + b"\n")
+                current = dict(zip(ORDER_FIELDS, row[:order_width]))
+                current["items"] = []
+            if row[order_width] is not None:
+                current["items"].append(dict(zip(ITEM_FIELDS, row[order_width:])))
+        if lines:
+            yield b"".join(lines)
+    if current is not None:
+        yield dumps(current) + b"\n"
+
+
+def export_response(body: Iterator, table: str, format: str) -> StreamingResponse:
+    return StreamingResponse(
+        body,
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'},
+    )
+
+
+@router.get("/customers")
+def export_customers(format: Literal["csv", "ndjson"] = "csv"):
+    body = to_csv(CUSTOMER_FIELDS, customer_rows()) if format == "csv" else customers_ndjson()
+    return export_response(body, "customers", format)
+
+
+@router.get("/orders")
+def export_orders(format: Literal["csv", "ndjson"] = "csv"):
+    if format == "csv":
+        body = to_csv(("order_id",) + ORDER_FIELDS[1:] + ITEM_FIELDS, order_item_rows())
+    else:
+        body = orders_ndjson()
+    return export_response(body, "orders", format)
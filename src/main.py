@@ -1,15 +1,28 @@
-import uvicorn
 import os
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from pathlib import Path
-from fastapi import FastAPI
-from src.CustomerOnboarding import router  # Import the router from CustomerOnboarding
 
-# Load environment variables
+# Load environment variables before the app modules read their settings: .env decides
+# DATABASE_URL and the other settings unless they are already set in the environment
 env_path = Path(__file__).parent.parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
+from fastapi import FastAPI
+from src.CustomerOnboarding import router, init_db, close_db  # Import the router from CustomerOnboarding
+from src.CustomerOnboarding import customer_cache, db_executor, get_async_engine, get_engine
+from src.engine import pool_status
+from src.metrics import Metrics, MetricsMiddleware, Sample, metrics_endpoint
+from src.query_stats import QueryStatsMiddleware, instrument_engines
+from src.slow_query import SlowQueryLog
+from src.profiling import ProfilingMiddleware, profiles_router
+from src.profiling import settings_from_env as profiling_settings_from_env
+from src.exports import router as export_router
+from src.compression import CompressionMiddleware
+from src.admission import HIGH, LOW, NORMAL, AdmissionController, AdmissionMiddleware
+
 # Configure logging
 logging.basicConfig(
     level=logging.DEBUG if os.getenv("ENV") == "development" else logging.INFO,
@@ -17,11 +30,149 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Create the FastAPI app object
-app = FastAPI()
+# Admission control priorities: order writes are admitted first, list and export reads last
+ROUTE_PRIORITIES = [
+    ("POST", "/api/orders/lookup", NORMAL),
+    ("POST", "/api/orders/*", HIGH),
+    ("GET", "/api/customers/", LOW),
+    ("GET", "/api/customers/pending/", LOW),
+    ("GET", "/api/orders/", LOW),
+    ("GET", "/api/export/*", LOW),
+]
+
+# Never shed: the metrics scrape and the admin (profiling) endpoints are needed most under overload
+ADMISSION_EXEMPT_PATHS = ["/metrics", "/admin/*"]
+
+POOL_GAUGES = (
+    ("size", "db_pool_size", "Connections the pool keeps open."),
+    ("checkedin", "db_pool_checked_in", "Idle connections in the pool."),
+    ("checkedout", "db_pool_checked_out", "Connections in use."),
+    ("overflow", "db_pool_overflow", "Connections opened above the pool size."),
+)
+
+def database_samples():
+    # Only engines that have already been created are reported
+    statuses = []
+    for label, get in (("sync", get_engine), ("async", get_async_engine)):
+        if get.cache_info().currsize:
+            engine = get()
+            statuses.append((label, pool_status(getattr(engine, "sync_engine", engine))))
+    for key, name, help_text in POOL_GAUGES:
+        for label, status in statuses:
+            if key in status:
+                yield Sample(name, "gauge", help_text, {"engine": label, "pool": status["pool"]}, status[key])
+
+def cache_samples():
+    if customer_cache is None:
+        return
+    stats = customer_cache.stats()
+    labels = {"cache": "customer"}
+    yield Sample("cache_hits_total", "counter", "Cache lookups served from the cache.", labels, stats["hits"])
+    yield Sample("cache_misses_total", "counter", "Cache lookups that went to the database.", labels, stats["misses"])
+    yield Sample("cache_evictions_total", "counter", "Entries evicted to make room.", labels, stats["evictions"])
+    yield Sample("cache_hit_ratio", "gauge", "Share of lookups served from the cache.", labels, stats["hit_ratio"])
+    yield Sample("cache_size", "gauge", "Entries currently cached.", labels, stats["size"])
+
+def executor_samples():
+    if db_executor is None:
+        return
+    yield Sample("db_executor_queue_depth", "gauge", "Sync handlers waiting for a DB executor thread.", {}, db_executor.queue_depth)
+    yield Sample("db_executor_running", "gauge", "Sync handlers running on the DB executor.", {}, db_executor.running)
+    yield Sample("db_executor_wait_seconds_total", "counter", "Time sync handlers spent queued.", {}, db_executor.wait_seconds_total)
+
+def admission_samples(controller: AdmissionController):
+    def collect():
+        yield Sample("admission_queued", "gauge", "Requests waiting for admission.", {}, controller.queued)
+        for priority, count in controller.admitted.items():
+            yield Sample("admission_admitted_total", "counter", "Requests admitted, by priority.", {"priority": priority}, count)
+        for priority, count in controller.shed.items():
+            yield Sample("admission_shed_total", "counter", "Requests shed with a 503, by priority.", {"priority": priority}, count)
+    return collect
+
+async def flush_metrics(metrics: Metrics, interval: float):
+    # Keeps this worker's snapshot current for scrapes answered by the other workers
+    while True:
+        await asyncio.sleep(interval)
+        metrics.write_snapshot()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs in each worker process: connections are only opened here, never at import
+    if os.getenv("SCHEMA_AUTO_CREATE", "1") == "1":
+        init_db()
+    slow_query_log = app.state.slow_query_log
+    if slow_query_log is not None:
+        slow_query_log.install()
+    metrics = getattr(app.state, "metrics", None)
+    flusher = None
+    if metrics is not None and metrics.multiproc_dir is not None:
+        metrics.write_snapshot()
+        flusher = asyncio.create_task(flush_metrics(metrics, float(os.getenv("METRICS_FLUSH_INTERVAL", 1))))
+    yield
+    if flusher is not None:
+        flusher.cancel()
+        # Counters outlive the worker; its gauges no longer describe anything
+        metrics.write_snapshot(live=False)
+    if slow_query_log is not None:
+        slow_query_log.remove()
+    await close_db()
+
+def create_app() -> FastAPI:
+    """Build the FastAPI app object; serve with `uvicorn --factory src.main:create_app`."""
+    app = FastAPI(lifespan=lifespan)
+
+    # Include the routers
+    app.include_router(router)
+    app.include_router(export_router)
+
+    # On-demand cProfile of single requests (PROFILING=1, X-Profile + X-Admin-Token headers)
+    profiling_settings = profiling_settings_from_env()
+    if profiling_settings is not None:
+        app.add_middleware(ProfilingMiddleware, **profiling_settings)
+        app.include_router(profiles_router(**profiling_settings))
+
+    # Per-request query counts and N+1 warnings; headers and request logs in development
+    if os.getenv("QUERY_STATS", "1") == "1":
+        instrument_engines()
+        app.add_middleware(
+            QueryStatsMiddleware,
+            headers=os.getenv("ENV") == "development" or os.getenv("QUERY_STATS_HEADERS") == "1",
+        )
+
+    # Statements slower than SLOW_QUERY_MS are logged with their plan (installed by the lifespan)
+    app.state.slow_query_log = SlowQueryLog.from_env()
+
+    # Compress large responses (gzip, or brotli when installed)
+    compression_settings = CompressionMiddleware.settings_from_env()
+    if compression_settings is not None:
+        app.add_middleware(CompressionMiddleware, **compression_settings)
+
+    # Admission control (outermost, so shed requests cost as little as possible)
+    app.state.admission_controller = AdmissionController.from_env()
+    if app.state.admission_controller is not None:
+        app.add_middleware(
+            AdmissionMiddleware,
+            controller=app.state.admission_controller,
+            rules=ROUTE_PRIORITIES,
+            retry_after=int(os.getenv("ADMISSION_RETRY_AFTER", 1)),
+            exempt_paths=ADMISSION_EXEMPT_PATHS,
+        )
+
+    # Metrics (outermost, so latency includes admission queueing and shed requests are counted)
+    if os.getenv("METRICS_ENABLED", "1") == "1":
+        # Merged across the pre-forked workers when METRICS_MULTIPROC_DIR is set (src.server sets it)
+        app.state.metrics = Metrics(multiproc_dir=os.getenv("METRICS_MULTIPROC_DIR") or None)
+        for collector in (database_samples, cache_samples, executor_samples):
+            app.state.metrics.collector(collector)
+        if app.state.admission_controller is not None:
+            app.state.metrics.collector(admission_samples(app.state.admission_controller))
+        app.add_middleware(MetricsMiddleware, metrics=app.state.metrics)
+        app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+    return app
 
-# Include the router
-app.include_router(router)
+# Module-level app for `uvicorn src.main:app` and the tests
+app = create_app()
 
 if __name__ == "__main__":
-    uvicorn.run("src.main:app", host="0.0.0.0", port=3000, reload=True)
\ No newline at end of file
+    import uvicorn
+    uvicorn.run("src.main:create_app", factory=True, host="0.0.0.0", port=3000, reload=True)
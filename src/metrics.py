@@ -0,0 +1,206 @@
+"""Prometheus-style metrics: per-route request counts, latency histograms and in-flight gauges,
+plus whatever gauges the registered collectors report at scrape time (DB pool, caches...).
+
+Request metrics are recorded by MetricsMiddleware on the event loop, which is the only
+thread that touches them, so the per-request cost is a few dict updates and no locks.
+
+Pre-forked workers share one listening socket, so a scrape lands on any one of them.
+With several workers, set METRICS_MULTIPROC_DIR (src.server does it): every worker writes
+a snapshot of its samples to <dir>/<pid>.json (every METRICS_FLUSH_INTERVAL seconds,
+default 1, and on each scrape), and a scrape answers with all the snapshots merged.
+Counters and histograms are summed, so they never go backwards between scrapes, and the
+totals of recycled workers are kept; gauges get a `pid` label and are dropped when their
+worker shuts down. The directory must be emptied before the workers start.
+"""
+import json
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Upper bounds, in seconds, of the latency histogram buckets (+Inf is implied)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Label used for requests that matched no route, so unknown paths cannot blow up cardinality
+UNMATCHED_ROUTE = "unmatched"
+
+
+class Sample(NamedTuple):
+    name: str
+    type: str
+    help: str
+    labels: Dict[str, str]
+    value: float
+
+
+Collector = Callable[[], Iterable[Sample]]
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+
+
+class Metrics:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, multiproc_dir: Optional[str] = None):
+        self.buckets = buckets
+        self.requests: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        self.durations: Dict[Tuple[str, str], _Histogram] = {}
+        self.in_flight = 0
+        self.collectors: List[Collector] = []
+        self.multiproc_dir = multiproc_dir
+
+    def collector(self, fn: Collector) -> Collector:
+        """Register `fn`, called on every scrape; it must yield the samples of a metric together."""
+        self.collectors.append(fn)
+        return fn
+
+    def observe(self, method: str, route: str, status: int, seconds: float) -> None:
+        self.requests[(method, route, str(status))] += 1
+        histogram = self.durations.get((method, route))
+        if histogram is None:
+            histogram = self.durations[(method, route)] = _Histogram(len(self.buckets) + 1)
+        histogram.counts[bisect_left(self.buckets, seconds)] += 1
+        histogram.sum += seconds
+
+    def samples(self) -> Iterable[Sample]:
+        for (method, route, status), count in list(self.requests.items()):
+            yield Sample("http_requests_total", "counter", "HTTP requests by route and status.",
+                         {"method": method, "route": route, "status": status}, count)
+
+        help_text = "HTTP request latency by route."
+        for (method, route), histogram in list(self.durations.items()):
+            labels = {"method": method, "route": route}
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield Sample("http_request_duration_seconds_bucket", "histogram", help_text, {**labels, "le": le}, cumulative)
+            yield Sample("http_request_duration_seconds_sum", "histogram", help_text, labels, histogram.sum)
+            yield Sample("http_request_duration_seconds_count", "histogram", help_text, labels, cumulative)
+
+        yield Sample("http_requests_in_flight", "gauge", "HTTP requests being processed.", {}, self.in_flight)
+
+        for collect in self.collectors:
+            yield from collect()
+
+    def write_snapshot(self, live: bool = True) -> None:
+        """Write this process's samples to the multiprocess directory; `live=False` drops its gauges."""
+        samples = [sample._asdict() for sample in self.samples() if live or sample.type != "gauge"]
+        path = os.path.join(self.multiproc_dir, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(samples, f)
+        # Atomic, so a concurrent scrape never reads a partial file
+        os.replace(path + ".tmp", path)
+
+    def collect(self) -> Iterable[Sample]:
+        """The samples to expose: this process's, or every worker's merged in multiprocess mode."""
+        if self.multiproc_dir is None:
+            return self.samples()
+        self.write_snapshot()
+        return merge_snapshots(self.multiproc_dir)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (0.0.4)."""
+        lines = []
+        described = set()
+        for sample in self.collect():
+            family = _family(sample)
+            if family not in described:
+                described.add(family)
+                lines.append(f"# HELP {family} {sample.help}")
+                lines.append(f"# TYPE {family} {sample.type}")
+            lines.append(f"{sample.name}{_format_labels(sample.labels)} {_format_value(sample.value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _family(sample: Sample) -> str:
+    return sample.name.rsplit("_", 1)[0] if sample.type == "histogram" else sample.name
+
+
+def merge_snapshots(directory: str) -> List[Sample]:
+    """Merge the workers' snapshots: counters and histograms summed, gauges labelled by pid."""
+    # Samples of a family must be contiguous in the exposition, so merge family by family
+    families: Dict[str, Dict[Tuple, Sample]] = {}
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        pid = filename[:-len(".json")]
+        for fields in snapshot:
+            sample = Sample(**fields)
+            if sample.type == "gauge":
+                sample = sample._replace(labels={**sample.labels, "pid": pid})
+            merged = families.setdefault(_family(sample), {})
+            key = (sample.name, tuple(sample.labels.items()))
+            if key in merged and sample.type != "gauge":
+                sample = sample._replace(value=merged[key].value + sample.value)
+            merged[key] = sample
+    return [sample for merged in families.values() for sample in merged.values()]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        metrics = self.metrics
+        metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            metrics.in_flight -= 1
+            # FastAPI records the matched route in the scope; its path template is the label
+            route = scope.get("route")
+            metrics.observe(scope["method"], getattr(route, "path", UNMATCHED_ROUTE), status_code,
+                            time.perf_counter() - started)
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(request.app.state.metrics.render(), media_type=CONTENT_TYPE)
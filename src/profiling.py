@@ -0,0 +1,242 @@
+"""On-demand profiling of single requests.
+
+With PROFILING=1, a request carrying `X-Profile: 1` and a matching `X-Admin-Token` runs under
+cProfile. That covers the event loop part of the request and, through the DB executor, the
+sync handler's worker thread. The profile is stored in PROFILE_DIR twice:
+
+    <id>.prof   pstats dump, for snakeviz / `python -m pstats`
+    <id>.json   summary: top functions, the callees of the heaviest ones, and time split
+                between SQLAlchemy, the DB driver, pydantic, serialization, FastAPI, the
+                app and waiting (idle event loop, thread handoffs)
+
+The response carries the profile id in X-Profile-Id. The summaries are served by
+/admin/profiles (same token). One request per process is profiled at a time, and a busy
+profiler answers `X-Profile: busy`. Other tasks that share the event loop while a request
+is profiled are included in its profile.
+
+    PROFILING        set to 1 to enable the hook (default: 0)
+    PROFILING_TOKEN  admin token required in X-Admin-Token (profiling stays off without one)
+    PROFILE_DIR      where profiles are written (default: ./data/profiles)
+"""
+import cProfile
+import hmac
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import FileResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile"
+TOKEN_HEADER = "X-Admin-Token"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+# Functions listed in a summary, and callees listed under each of the heaviest ones
+TOP_FUNCTIONS = 25
+CALL_TREE_ROOTS = 10
+CALL_TREE_CALLEES = 5
+
+# (category, path fragments), first match wins; built-ins are matched on their name.
+# Compiled pydantic never shows up in a profile: its time is counted in the FastAPI
+# functions that call it to validate request bodies and responses.
+CATEGORIES = [
+    ("waiting", ("select.epoll", "select.kqueue", "_thread.lock", "_overlapped")),
+    ("serialization", ("orjson", "/json/", "src/responses.py", "jsonable_encoder", "/csv.py")),
+    ("db_driver", ("sqlite3", "aiosqlite", "asyncpg", "psycopg2")),
+    ("sqlalchemy", ("/sqlalchemy/",)),
+    ("pydantic", ("/pydantic/", "pydantic_core", "(request_body_to_args)", "(serialize_response)")),
+    ("framework", ("/fastapi/", "/starlette/", "/anyio/", "/uvicorn/")),
+    ("app", ("/src/",)),
+]
+
+_active: ContextVar[Optional["ProfileSession"]] = ContextVar("profile_session", default=None)
+
+
+class ProfileSession:
+    """The profiles (one per thread) collected for one request."""
+
+    def __init__(self):
+        self.profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def add(self, profile: cProfile.Profile) -> None:
+        with self._lock:
+            self.profiles.append(profile)
+
+    def stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        return stats
+
+
+def run_profiled(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Call fn, under its own profiler when the current request is being profiled."""
+    session = _active.get()
+    if session is None:
+        return fn(*args, **kwargs)
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(fn, *args, **kwargs)
+    finally:
+        session.add(profile)
+
+
+def _label(func) -> str:
+    filename, line, name = func
+    return name if filename == "~" else f"{filename}:{line}({name})"
+
+
+def _category(func) -> str:
+    location = _label(func)
+    for category, fragments in CATEGORIES:
+        if any(fragment in location for fragment in fragments):
+            return category
+    return "other"
+
+
+def summarize(stats: pstats.Stats, wall_seconds: float) -> Dict[str, Any]:
+    entries = stats.stats
+    categories: Dict[str, float] = {}
+    callees: Dict[Any, List] = {}
+    for func, (_, _, tottime, _, callers) in entries.items():
+        category = _category(func)
+        categories[category] = categories.get(category, 0.0) + tottime
+        for caller, (_, _, _, cumtime) in callers.items():
+            callees.setdefault(caller, []).append((cumtime, func))
+
+    def row(func):
+        _, calls, tottime, cumtime, _ = entries[func]
+        return {"function": _label(func), "calls": calls, "tottime": tottime, "cumtime": cumtime}
+
+    by_cumulative = sorted(entries, key=lambda func: entries[func][3], reverse=True)
+    by_own_time = sorted(entries, key=lambda func: entries[func][2], reverse=True)
+    return {
+        "wall_seconds": wall_seconds,
+        "profiled_seconds": stats.total_tt,
+        "categories": dict(sorted(categories.items(), key=lambda item: item[1], reverse=True)),
+        "top_cumulative": [row(func) for func in by_cumulative[:TOP_FUNCTIONS]],
+        "top_own_time": [row(func) for func in by_own_time[:TOP_FUNCTIONS]],
+        "call_tree": [
+            {
+                **row(func),
+                "callees": [
+                    {"function": _label(callee), "cumtime": cumtime}
+                    for cumtime, callee in sorted(callees.get(func, []), key=lambda item: item[0], reverse=True)[:CALL_TREE_CALLEES]
+                ],
+            }
+            for func in by_cumulative[:CALL_TREE_ROOTS]
+        ],
+    }
+
+
+class ProfilingMiddleware:
+    def __init__(self, app: ASGIApp, token: str, directory: str):
+        self.app = app
+        self.token = token
+        self.directory = Path(directory)
+        self._busy = threading.Lock()
+
+    def _requested(self, scope: Scope) -> bool:
+        headers = Headers(scope=scope)
+        if headers.get(PROFILE_HEADER) != "1":
+            return False
+        return hmac.compare_digest(headers.get(TOKEN_HEADER, ""), self.token)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+        if not self._busy.acquire(blocking=False):
+            await self.app(scope, receive, _with_headers(send, {PROFILE_HEADER: "busy"}))
+            return
+
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        session = ProfileSession()
+        token = _active.set(session)
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profile.enable()
+            try:
+                await self.app(scope, receive, _with_headers(send, {PROFILE_ID_HEADER: profile_id}))
+            finally:
+                profile.disable()
+                session.add(profile)
+                _active.reset(token)
+            self._store(profile_id, session, time.perf_counter() - started, scope)
+        finally:
+            self._busy.release()
+
+    def _store(self, profile_id: str, session: ProfileSession, wall_seconds: float, scope: Scope) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stats = session.stats()
+        stats.dump_stats(self.directory / f"{profile_id}.prof")
+        summary = {"id": profile_id, "method": scope["method"], "path": scope["path"], **summarize(stats, wall_seconds)}
+        (self.directory / f"{profile_id}.json").write_text(json.dumps(summary, indent=2))
+        logger.info("Profiled %s %s in %.1f ms as %s", scope["method"], scope["path"], wall_seconds * 1000, profile_id)
+
+
+def _with_headers(send: Send, extra: Dict[str, str]) -> Send:
+    async def send_wrapper(message: Message) -> None:
+        if message["type"] == "http.response.start":
+            headers = MutableHeaders(raw=message["headers"])
+            for name, value in extra.items():
+                headers[name] = value
+        await send(message)
+    return send_wrapper
+
+
+def profiles_router(token: str, directory: str) -> APIRouter:
+    """Admin endpoints listing and serving stored profiles."""
+    router = APIRouter(prefix="/admin/profiles", tags=["Admin"])
+    base = Path(directory)
+
+    def check(admin_token: str) -> None:
+        if not hmac.compare_digest(admin_token, token):
+            raise HTTPException(status_code=403, detail="Invalid admin token")
+
+    def path_for(profile_id: str, suffix: str) -> Path:
+        path = base / f"{Path(profile_id).name}{suffix}"
+        if not path.is_file():
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return path
+
+    @router.get("/")
+    def list_profiles(admin_token: str = Header("", alias=TOKEN_HEADER)):
+        check(admin_token)
+        return sorted((path.stem for path in base.glob("*.json")), reverse=True) if base.is_dir() else []
+
+    @router.get("/{profile_id}")
+    def get_profile(profile_id: str, admin_token: str = Header("", alias=TOKEN_HEADER)):
+        check(admin_token)
+        return json.loads(path_for(profile_id, ".json").read_text())
+
+    @router.get("/{profile_id}/pstats")
+    def download_profile(profile_id: str, admin_token: str = Header("", alias=TOKEN_HEADER)):
+        check(admin_token)
+        return FileResponse(path_for(profile_id, ".prof"), media_type="application/octet-stream")
+
+    return router
+
+
+def settings_from_env() -> Optional[dict]:
+    """Keyword arguments for the middleware and router, or None when profiling is off."""
+    if os.getenv("PROFILING", "0") != "1":
+        return None
+    token = os.getenv("PROFILING_TOKEN", "")
+    if not token:
+        logger.warning("PROFILING=1 but PROFILING_TOKEN is not set; profiling stays disabled")
+        return None
+    return {"token": token, "directory": os.getenv("PROFILE_DIR", "./data/profiles")}
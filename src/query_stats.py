@@ -0,0 +1,145 @@
+"""Per-request SQL accounting and N+1 detection.
+
+Engine events count every statement and its execution time into the QueryStats of the
+request being served (held in a contextvar, which the DB executor and AsyncSession both
+carry along). A statement executed N_PLUS_ONE_THRESHOLD or more times within one request
+is reported as an N+1 suspect: usually a lazy load, or a query issued inside a loop.
+
+In development (ENV=development, or QUERY_STATS_HEADERS=1) every response carries
+X-DB-Query-Count and X-DB-Query-Time-Ms, plus X-DB-N-Plus-One when suspects were found,
+and each request is logged with the same fields. Observers registered with `observe()`
+receive every request's stats; the `query_budget` test fixture is built on them.
+
+    QUERY_STATS                   set to 0 to disable the accounting (default: 1)
+    QUERY_STATS_HEADERS           set to 1 to add the headers outside development
+    QUERY_N_PLUS_ONE_THRESHOLD    executions of one statement that make it a suspect (default: 3)
+"""
+import logging
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Callable, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+N_PLUS_ONE_THRESHOLD = int(os.getenv("QUERY_N_PLUS_ONE_THRESHOLD", 3))
+
+QUERY_COUNT_HEADER = "X-DB-Query-Count"
+QUERY_TIME_HEADER = "X-DB-Query-Time-Ms"
+N_PLUS_ONE_HEADER = "X-DB-N-Plus-One"
+
+
+class QueryStats:
+    def __init__(self, scope: Optional[Scope] = None):
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter = Counter()
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def n_plus_one_suspects(self, threshold: int = None) -> List[str]:
+        threshold = N_PLUS_ONE_THRESHOLD if threshold is None else threshold
+        return [statement for statement, count in self.statements.items() if count >= threshold]
+
+    def summary(self) -> str:
+        lines = [f"{self.count} queries in {self.seconds * 1000:.1f} ms"]
+        lines += [f"  {count}x {statement}" for statement, count in self.statements.most_common()]
+        return "\n".join(lines)
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+RequestObserver = Callable[[Scope, QueryStats], None]
+_observers: List[RequestObserver] = []
+
+
+def current_stats() -> Optional[QueryStats]:
+    return _current.get()
+
+
+def current_route() -> Optional[str]:
+    """The request being served as "METHOD /route/{template}", or None outside a request."""
+    stats = _current.get()
+    if stats is None or stats.scope is None:
+        return None
+    route = stats.scope.get("route")
+    return f"{stats.scope['method']} {getattr(route, 'path', stats.scope['path'])}"
+
+
+def observe(observer: RequestObserver) -> Callable[[], None]:
+    """Call `observer(scope, stats)` after every request; returns a function that unregisters it."""
+    _observers.append(observer)
+    return lambda: _observers.remove(observer)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current.get() is not None:
+        context._query_stats_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = getattr(context, "_query_stats_started", None)
+    if stats is not None and started is not None:
+        stats.record(statement, time.perf_counter() - started)
+
+
+def instrument_engines() -> None:
+    """Listen on every Engine (sync engines and the sync side of async ones); idempotent."""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class QueryStatsMiddleware:
+    def __init__(self, app: ASGIApp, headers: bool = False):
+        self.app = app
+        self.headers = headers
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(scope)
+        token = _current.set(stats)
+
+        async def send_wrapper(message: Message) -> None:
+            if self.headers and message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                headers[QUERY_COUNT_HEADER] = str(stats.count)
+                headers[QUERY_TIME_HEADER] = f"{stats.seconds * 1000:.2f}"
+                suspects = stats.n_plus_one_suspects()
+                if suspects:
+                    headers[N_PLUS_ONE_HEADER] = str(len(suspects))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            self._report(scope, stats)
+
+    def _report(self, scope: Scope, stats: QueryStats) -> None:
+        for statement in stats.n_plus_one_suspects():
+            logger.warning(
+                "Possible N+1 in %s %s: statement executed %d times: %s",
+                scope["method"], scope["path"], stats.statements[statement], statement,
+            )
+        if self.headers:
+            logger.info(
+                "%s %s db_queries=%d db_time_ms=%.2f",
+                scope["method"], scope["path"], stats.count, stats.seconds * 1000,
+            )
+        for observer in list(_observers):
+            observer(scope, stats)
@@ -0,0 +1,34 @@
+"""Fast JSON response class for trusted, already-serialized server data.
+
+Handlers that build their payload with the serializers in CustomerOnboarding return a
+FastJSONResponse instance directly. FastAPI then skips both the response_model
+re-validation and the jsonable_encoder walk, and the body is rendered by orjson when it
+is installed (falling back to a compact stdlib encoder otherwise).
+"""
+import json
+from datetime import date, datetime
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,97 @@
+"""Production launcher: pre-forked uvicorn workers serving the app factory.
+
+The parent process binds the socket once and supervises the workers (uvicorn's
+multiprocess supervisor): a worker that exits, for instance after serving its request
+budget, is replaced, and SIGTERM/SIGINT drains every worker (in-flight requests finish,
+up to the graceful timeout) before exiting. With a single worker there is no supervisor,
+so request-budget recycling is left off.
+Workers use uvloop and httptools when they are installed (`uvicorn[standard]`).
+
+    python -m src.server [--host 0.0.0.0] [--port 3000] [--workers N]
+
+Every option falls back to the environment:
+
+    HOST / PORT            listen address (default: 0.0.0.0:3000)
+    WEB_CONCURRENCY        worker processes (default: CPU count)
+    MAX_REQUESTS           requests a worker serves before it is recycled, 0 disables (default: 10000)
+    MAX_REQUESTS_JITTER    random extra requests per worker, so they do not recycle together (default: 1000)
+    GRACEFUL_TIMEOUT       seconds a draining worker waits for in-flight requests (default: 30)
+    KEEPALIVE_TIMEOUT      seconds an idle keep-alive connection is kept open (default: 5)
+    ACCESS_LOG             set to 1 to log every request (default: 0)
+    METRICS_MULTIPROC_DIR  where the workers merge their metrics (default: a new temporary
+                           directory when there are several workers); emptied at startup
+"""
+import argparse
+import glob
+import importlib.util
+import os
+import tempfile
+
+import uvicorn
+
+APP = "src.main:create_app"
+
+
+def fastest_available(*candidates: str) -> str:
+    """First installed module among candidates; the last one is the stdlib fallback."""
+    for name in candidates[:-1]:
+        if importlib.util.find_spec(name) is not None:
+            return name
+    return candidates[-1]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the API with pre-forked uvicorn workers.")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 3000)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("MAX_REQUESTS", 10000)))
+    parser.add_argument("--max-requests-jitter", type=int, default=int(os.getenv("MAX_REQUESTS_JITTER", 1000)))
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", 30)))
+    parser.add_argument("--keepalive-timeout", type=int, default=int(os.getenv("KEEPALIVE_TIMEOUT", 5)))
+    parser.add_argument("--access-log", action="store_true", default=os.getenv("ACCESS_LOG", "0") == "1")
+    return parser.parse_args(argv)
+
+
+def server_options(args: argparse.Namespace) -> dict:
+    """Keyword arguments for uvicorn.run."""
+    # A single worker runs without a supervisor, so nothing would replace a recycled worker
+    recycle = args.max_requests > 0 and args.workers > 1
+    return {
+        "factory": True,
+        "host": args.host,
+        "port": args.port,
+        "workers": args.workers,
+        "loop": fastest_available("uvloop", "asyncio"),
+        "http": fastest_available("httptools", "h11"),
+        "lifespan": "on",
+        "access_log": args.access_log,
+        "limit_max_requests": args.max_requests if recycle else None,
+        "limit_max_requests_jitter": args.max_requests_jitter if recycle else 0,
+        "timeout_graceful_shutdown": args.graceful_timeout,
+        "timeout_keep_alive": args.keepalive_timeout,
+    }
+
+
+def prepare_metrics_dir(workers: int) -> None:
+    """Give the workers a shared, empty METRICS_MULTIPROC_DIR so a scrape reports all of them."""
+    if workers <= 1:
+        return
+    directory = os.environ.get("METRICS_MULTIPROC_DIR") or tempfile.mkdtemp(prefix="metrics-")
+    os.makedirs(directory, exist_ok=True)
+    # Snapshots of a previous run would be added to this one's counters
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        os.remove(path)
+    os.environ["METRICS_MULTIPROC_DIR"] = directory
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    # The workers inherit it, so per-process state (the customer cache) knows it is not alone
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    prepare_metrics_dir(args.workers)
+    uvicorn.run(APP, **server_options(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Slow query log with automatic EXPLAIN capture.
+
+Every statement slower than the threshold is logged with its parameters, duration and the
+route that issued it. The first time a given statement is slow, its plan is captured as
+well: EXPLAIN QUERY PLAN on SQLite, EXPLAIN on Postgres (which plans without executing).
+The plan is read on a raw cursor of the same connection and transaction, so it neither
+shows up in the query accounting nor triggers the log itself. It runs inside a SAVEPOINT:
+a failed EXPLAIN would otherwise abort the request's transaction on Postgres.
+
+    SLOW_QUERY_MS           threshold in milliseconds, 0 disables the log (default: 500)
+"""
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from src.query_stats import current_route
+
+logger = logging.getLogger(__name__)
+
+# Statement kinds EXPLAIN accepts on both databases
+EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")
+
+# Longest parameter repr written to the log
+MAX_PARAMETERS_LENGTH = 500
+
+EXPLAIN_SAVEPOINT = "slow_query_explain"
+
+
+class SlowQueryLog:
+    def __init__(self, threshold: float, max_plans: int = 1000):
+        self.threshold = threshold
+        self.max_plans = max_plans
+        self.slow_queries = 0
+        self._explained = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["SlowQueryLog"]:
+        threshold_ms = float(os.getenv("SLOW_QUERY_MS", 500))
+        if threshold_ms <= 0:
+            return None
+        return cls(threshold_ms / 1000)
+
+    def install(self, target=Engine) -> None:
+        """Listen on `target`: one engine, or every Engine by default."""
+        event.listen(target, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(target, "after_cursor_execute", self._after_cursor_execute)
+
+    def remove(self, target=Engine) -> None:
+        event.remove(target, "before_cursor_execute", self._before_cursor_execute)
+        event.remove(target, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._slow_query_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_slow_query_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        if elapsed < self.threshold:
+            return
+
+        self.slow_queries += 1
+        plan = None
+        if not executemany and statement.lstrip().split(None, 1)[0].upper() in EXPLAINABLE and self._first_time(statement):
+            plan = self.explain(conn, statement, parameters)
+        logger.warning(
+            "Slow query (%.1f ms) in %s: %s; parameters=%s%s",
+            elapsed * 1000,
+            current_route() or "background task",
+            statement,
+            repr(parameters)[:MAX_PARAMETERS_LENGTH],
+            f"\nplan:\n{plan}" if plan else "",
+        )
+
+    def _first_time(self, statement: str) -> bool:
+        with self._lock:
+            if statement in self._explained or len(self._explained) >= self.max_plans:
+                return False
+            self._explained.add(statement)
+            return True
+
+    @staticmethod
+    def explain(conn, statement: str, parameters) -> str:
+        sqlite = conn.dialect.name == "sqlite"
+        savepoint = conn.in_transaction()
+        cursor = conn.connection.cursor()
+        try:
+            if savepoint:
+                cursor.execute(f"SAVEPOINT {EXPLAIN_SAVEPOINT}")
+            try:
+                cursor.execute(("EXPLAIN QUERY PLAN " if sqlite else "EXPLAIN ") + statement, parameters)
+                rows = cursor.fetchall()
+            except Exception as exc:
+                if savepoint:
+                    cursor.execute(f"ROLLBACK TO SAVEPOINT {EXPLAIN_SAVEPOINT}")
+                return f"(EXPLAIN failed: {exc})"
+            finally:
+                if savepoint:
+                    cursor.execute(f"RELEASE SAVEPOINT {EXPLAIN_SAVEPOINT}")
+        finally:
+            cursor.close()
+        if sqlite:
+            # (id, parent, notused, detail)
+            return "\n".join(f"  {row[3]}" for row in rows)
+        return "\n".join(f"  {row[0]}" for row in rows)
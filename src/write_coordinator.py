@@ -0,0 +1,131 @@
+"""Group-commit writer for SQLite deployments.
+
+SQLite allows a single writer at a time, so concurrent request handlers that each open
+their own write transaction queue up on the database lock (and eventually fail with
+"database is locked"). The WriteCoordinator funnels those transactions into one writer
+thread instead. The thread drains its queue into batches, runs every transaction of a
+batch inside its own SAVEPOINT on a single session and commits the batch once, so N
+writes cost one fsync. Each submitter gets a Future that resolves once its batch is durable.
+
+Enabled through the environment:
+
+    WRITE_COORDINATOR             set to 1 to route handler writes through the coordinator
+    WRITE_COORDINATOR_MAX_BATCH   transactions per group commit (default: 64)
+    WRITE_COORDINATOR_MAX_DELAY_MS how long the writer waits to fill a batch (default: 2)
+"""
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from src.engine import WRITE_TRANSACTION
+
+logger = logging.getLogger(__name__)
+
+WriteFn = Callable[[Session], Any]
+
+
+class WriteCoordinator:
+    """Serialize write transactions into batched group commits on one writer thread."""
+
+    def __init__(self, session_factory: sessionmaker, max_batch: int = 64, max_delay: float = 0.002):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.writes = 0
+        self._queue: "queue.Queue[Optional[Tuple[WriteFn, Future]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, session_factory: sessionmaker) -> Optional["WriteCoordinator"]:
+        if os.getenv("WRITE_COORDINATOR", "0") != "1":
+            return None
+        return cls(
+            session_factory,
+            max_batch=int(os.getenv("WRITE_COORDINATOR_MAX_BATCH", 64)),
+            max_delay=int(os.getenv("WRITE_COORDINATOR_MAX_DELAY_MS", 2)) / 1000,
+        )
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="write-coordinator", daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        """Commit whatever is queued, then stop the writer thread."""
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def submit(self, fn: WriteFn) -> Future:
+        """Queue `fn(session)`; the Future resolves with its result once its batch commits."""
+        self.start()
+        future: Future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    async def run(self, fn: WriteFn) -> Any:
+        return await asyncio.wrap_future(self.submit(fn))
+
+    def _collect_batch(self, first: Tuple[WriteFn, Future]) -> Tuple[List[Tuple[WriteFn, Future]], bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch, stopping = self._collect_batch(item)
+            self._commit_batch(batch)
+
+    def _commit_batch(self, batch: List[Tuple[WriteFn, Future]]) -> None:
+        committed = []
+        with self.session_factory() as session:
+            session.connection(execution_options=WRITE_TRANSACTION)
+            for fn, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    # A failing transaction only rolls back its own savepoint
+                    with session.begin_nested():
+                        result = fn(session)
+                except Exception as exc:
+                    future.set_exception(exc)
+                else:
+                    committed.append((future, result))
+
+            try:
+                session.commit()
+            except Exception as exc:
+                logger.exception("Group commit of %d writes failed", len(committed))
+                for future, _ in committed:
+                    future.set_exception(exc)
+                return
+
+        self.batches += 1
+        self.writes += len(committed)
+        for future, result in committed:
+            future.set_result(result)
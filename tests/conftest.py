@@ -0,0 +1,42 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+
+# Point the app at a throwaway SQLite file before src.CustomerOnboarding creates its engines,
+# so test runs never touch data/test.db
+TEST_DB_DIR = tempfile.mkdtemp(prefix="supplychain-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DB_DIR, 'test.db')}"
+
+def pytest_sessionfinish(session, exitstatus):
+    # The module-level TestClient never runs the lifespan; close the pooled connections here,
+    # since every pooled aiosqlite connection keeps a thread that would hold the process open
+    from src.CustomerOnboarding import close_db
+    asyncio.run(close_db())
+    shutil.rmtree(TEST_DB_DIR, ignore_errors=True)
+
+@pytest.fixture
+def query_budget():
+    """Fail if any request made inside `with query_budget(n):` runs more than n SQL statements.
+
+    Requests that repeat a statement (an N+1 suspect) fail as well unless allow_repeats=True.
+    """
+    from src.query_stats import observe
+
+    @contextmanager
+    def budget(max_queries, allow_repeats=False):
+        requests = []
+        unregister = observe(lambda scope, stats: requests.append((scope["method"], scope["path"], stats)))
+        try:
+            yield requests
+        finally:
+            unregister()
+        for method, path, stats in requests:
+            assert stats.count <= max_queries, f"{method} {path} exceeded its budget of {max_queries}: {stats.summary()}"
+            if not allow_repeats:
+                assert not stats.n_plus_one_suspects(), f"{method} {path} repeats statements: {stats.summary()}"
+
+    return budget
@@ -1,20 +1,67 @@
 import pytest
 from fastapi.testclient import TestClient
-from src.main import app
-from src.CustomerOnboarding import Base, engine, SessionLocal
+from src.main import app, create_app
+from src.CustomerOnboarding import Base, engine, SessionLocal, async_engine, CustomerModel, IdempotencyKey, customer_cache
+from src.cache import MISSING, DiskBackend, MemoryBackend, RecordCache
+from src.engine import create_async_db_engine, create_db_engine, pool_capacity, pool_status, to_async_url
+from src.write_coordinator import WriteCoordinator
+from src.responses import FastJSONResponse
+from src.singleflight import AsyncSingleFlight, SingleFlight
+from src.compression import CompressionMiddleware, no_compression
+from src.admission import HIGH, LOW, NORMAL, AdmissionController
+from src.executor import DBExecutor, db_handler
+from src.server import parse_args, server_options
+from src.server import main as server_main
+from src.metrics import Metrics
+from src.query_stats import QueryStats, QueryStatsMiddleware
+from src.slow_query import SlowQueryLog
+from benchmarks import load as load_benchmark
+import os
+import pstats
+import logging
+from src.CustomerOnboarding import db_executor
+import contextvars
+import subprocess
+import sys
+from sqlalchemy import inspect
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import time
+from sqlalchemy import event
+from contextlib import contextmanager
+import csv
+import io
+import json
 import uuid
+from datetime import datetime
 from itertools import count
+import gzip
 from random import randrange as randbetween
 
 client = TestClient(app)
+admission_controller = app.state.admission_controller
 
 @pytest.fixture(autouse=True)
 def clear_database():
     # Drop all tables and recreate them before each test
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    customer_cache.clear()
     yield
 
+@contextmanager
+def count_queries(target):
+    """Collect the statements executed on an engine while the block runs."""
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(target, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(target, "before_cursor_execute", record)
+
 @pytest.fixture
 def generate_unique_name():
     """Generate a unique name by appending a UUID suffix."""
@@ -125,7 +172,7 @@ def test_create_order(create_customer):
     }
     response = client.post("/api/orders/", json=order_payload)
     assert response.status_code == 201
-    assert response.json()["total_amount"] == 2450.50
+    assert response.json()["total_amount"] == 2526.0
 
 def test_get_order(create_customer):
     # Use the consistent customer created by the fixture
@@ -163,4 +210,1055 @@ def test_list_orders(create_customer):
     # List all orders
     response = client.get("/api/orders/")
     assert response.status_code == 200
-    assert len(response.json()) > 0
\ No newline at end of file
+    assert len(response.json()) > 0
+
+def test_get_order_returns_items(create_customer):
+    order_payload = {
+        "customer_id": create_customer,
+        "items": [
+            {"product_name": "Laptop", "quantity": 2, "unit_price": 1200.50},
+            {"product_name": "Mouse", "quantity": 5, "unit_price": 25.00}
+        ]
+    }
+    order_id = client.post("/api/orders/", json=order_payload).json()["id"]
+
+    response = client.get(f"/api/orders/{order_id}")
+    assert response.status_code == 200
+    assert [item["product_name"] for item in response.json()["items"]] == ["Laptop", "Mouse"]
+
+def test_get_order_not_found():
+    response = client.get("/api/orders/999")
+    assert response.status_code == 404
+
+def _batch_customer(company_name):
+    return {
+        "company_name": company_name,
+        "customer_type": "supplier",
+        "tax_id": "TX123456888",
+        "registration_date": "2025-03-31T12:00:00",
+        "contact_email": "batch@company.com",
+        "contact_phone": "+1234567891",
+        "address": "123 Batch St",
+        "credit_score": 750,
+        "approved_credit_limit": 300000.0,
+        "status": "pending"
+    }
+
+def test_create_customers_batch_rejects_existing(create_customer):
+    payload = [_batch_customer("Fresh Batch Company"), _batch_customer(create_customer)]
+    response = client.post("/api/customers/batch", json=payload)
+    assert response.status_code == 400
+    assert create_customer in response.json()["detail"]
+    assert client.get("/api/customers/Fresh Batch Company").status_code == 404
+
+def test_create_customers_batch_rejects_repeated_names():
+    payload = [_batch_customer("Twin Company"), _batch_customer("Twin Company")]
+    response = client.post("/api/customers/batch", json=payload)
+    assert response.status_code == 400
+
+def test_create_customers_batch_returns_created_names():
+    payload = [_batch_customer(f"Bulk Company {i}") for i in range(3)]
+    response = client.post("/api/customers/batch", json=payload)
+    assert response.status_code == 201
+    assert response.json()["company_names"] == [f"Bulk Company {i}" for i in range(3)]
+    assert len(client.get("/api/customers/").json()) == 3
+
+def test_list_customers_keyset_pagination():
+    payload = [_batch_customer(f"Paged Company {i}") for i in range(5)]
+    payload[4]["customer_type"] = "retailer"
+    client.post("/api/customers/batch", json=payload)
+
+    first = client.get("/api/customers/", params={"limit": 2})
+    assert [c["company_name"] for c in first.json()] == ["Paged Company 0", "Paged Company 1"]
+    cursor = first.headers["X-Next-Cursor"]
+
+    second = client.get("/api/customers/", params={"limit": 2, "after": cursor})
+    assert [c["company_name"] for c in second.json()] == ["Paged Company 2", "Paged Company 3"]
+
+    retailers = client.get("/api/customers/pending/", params={"customer_type": "retailer"})
+    assert [c["company_name"] for c in retailers.json()] == ["Paged Company 4"]
+    assert "X-Next-Cursor" not in retailers.headers
+
+def test_list_orders_filters(create_customer):
+    for quantity in (1, 10, 100):
+        client.post("/api/orders/", json={
+            "customer_id": create_customer,
+            "items": [{"product_name": "Pallet", "quantity": quantity, "unit_price": 10.0}]
+        })
+
+    response = client.get("/api/orders/", params={"min_amount": 50, "max_amount": 500})
+    assert [order["total_amount"] for order in response.json()] == [100.0]
+
+    first = client.get("/api/orders/", params={"limit": 2, "customer_id": create_customer})
+    assert len(first.json()) == 2
+    rest = client.get("/api/orders/", params={"after": first.headers["X-Next-Cursor"]})
+    assert [order["total_amount"] for order in rest.json()] == [1000.0]
+
+def test_order_reads_query_count_is_constant(create_customer):
+    for quantity in range(1, 4):
+        client.post("/api/orders/", json={
+            "customer_id": create_customer,
+            "items": [
+                {"product_name": "Crate", "quantity": quantity, "unit_price": 5.0},
+                {"product_name": "Lid", "quantity": quantity, "unit_price": 1.0}
+            ]
+        })
+
+    # One query for the order, one for its items
+    with count_queries(async_engine.sync_engine) as statements:
+        assert client.get("/api/orders/1").status_code == 200
+    assert len(statements) == 2
+
+    # The items of a whole page are fetched in a single extra query
+    with count_queries(async_engine.sync_engine) as statements:
+        response = client.get("/api/orders/")
+    assert len(response.json()) == 3
+    assert len(statements) == 2
+
+def test_create_orders_batch_ndjson(create_customer, monkeypatch):
+    monkeypatch.setattr("src.CustomerOnboarding.ORDER_BATCH_CHUNK_SIZE", 2)
+    lines = [
+        json.dumps({"customer_id": create_customer,
+                    "items": [{"product_name": "Bolt", "quantity": 10, "unit_price": 0.5}]}),
+        "{not json",
+        json.dumps({"customer_id": create_customer,
+                    "items": [{"product_name": "Nut", "quantity": 4, "unit_price": 0.25},
+                              {"product_name": "Washer", "quantity": 4, "unit_price": 0.1}]}),
+        "",
+        json.dumps({"customer_id": create_customer, "items": [{"product_name": "Gear"}]}),
+        json.dumps({"customer_id": create_customer,
+                    "items": [{"product_name": "Spring", "quantity": 1, "unit_price": 3.0}]}),
+    ]
+    response = client.post("/api/orders/batch", content="\n".join(lines),
+                           headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+
+    results = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda r: r["line"])
+    assert [(r["line"], r["result"]) for r in results] == [
+        (1, "created"), (2, "error"), (3, "created"), (5, "error"), (6, "created")
+    ]
+    assert [r["total_amount"] for r in results if r["result"] == "created"] == [5.0, 1.4, 3.0]
+
+    order = client.get(f"/api/orders/{results[2]['id']}").json()
+    assert [item["product_name"] for item in order["items"]] == ["Nut", "Washer"]
+
+def test_create_orders_batch_reports_only_the_failing_rows(create_customer):
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TRIGGER reject_blocked BEFORE INSERT ON orders WHEN NEW.customer_id = 'Blocked' "
+            "BEGIN SELECT RAISE(ABORT, 'blocked customer'); END"
+        )
+    lines = [
+        json.dumps({"customer_id": customer_id, "items": [{"product_name": "Bolt", "quantity": 1, "unit_price": 2.0}]})
+        for customer_id in (create_customer, "Blocked", create_customer)
+    ]
+    response = client.post("/api/orders/batch", content="\n".join(lines),
+                           headers={"Content-Type": "application/x-ndjson"})
+
+    results = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda r: r["line"])
+    assert [(r["line"], r["result"]) for r in results] == [(1, "created"), (2, "error"), (3, "created")]
+    assert "blocked customer" in results[1]["detail"]
+    assert len(client.get("/api/orders/").json()) == 2
+
+# Engine Tests
+def test_engine_applies_sqlite_pragmas():
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+
+def test_engine_pool_settings_from_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "2")
+    tuned = create_db_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+    try:
+        with tuned.connect():
+            status = pool_status(tuned)
+        assert status["pool"] == "QueuePool"
+        assert status["size"] == 3
+        assert tuned.pool._max_overflow == 2
+        assert pool_status(tuned)["checkedin"] == 1
+    finally:
+        tuned.dispose()
+
+def test_async_sqlite_engine_pools_connections(tmp_path):
+    async_tuned = create_async_db_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+    connects = []
+    event.listen(async_tuned.sync_engine, "connect", lambda *args: connects.append(1))
+
+    async def read_twice():
+        for _ in range(2):
+            async with async_tuned.connect() as conn:
+                await conn.exec_driver_sql("SELECT 1")
+        await async_tuned.dispose()
+
+    asyncio.run(read_twice())
+    assert pool_status(async_tuned.sync_engine)["pool"] == "AsyncAdaptedQueuePool"
+    assert len(connects) == 1
+
+def test_pool_pre_ping_is_configurable(monkeypatch, tmp_path):
+    sqlite_engine = create_db_engine(f"sqlite:///{tmp_path / 'ping.db'}")
+    assert sqlite_engine.pool._pre_ping is False
+    monkeypatch.setenv("DB_POOL_PRE_PING", "1")
+    pinged_engine = create_db_engine(f"sqlite:///{tmp_path / 'ping.db'}")
+    assert pinged_engine.pool._pre_ping is True
+
+def test_async_url_uses_async_drivers():
+    assert to_async_url("sqlite:///./data/test.db").drivername == "sqlite+aiosqlite"
+    assert to_async_url("postgresql://u:p@db/supplychain").drivername == "postgresql+asyncpg"
+
+# Write Coordinator Tests
+@pytest.fixture
+def write_coordinator(monkeypatch):
+    coordinator = WriteCoordinator(SessionLocal, max_batch=50, max_delay=0.05)
+    monkeypatch.setattr("src.CustomerOnboarding.write_coordinator", coordinator)
+    yield coordinator
+    coordinator.stop()
+
+def test_write_coordinator_group_commits_concurrent_writes(write_coordinator):
+    def create(i):
+        return client.post("/api/customers/", json=_batch_customer(f"Grouped Company {i:02d}")).status_code
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        assert list(pool.map(create, range(20))) == [201] * 20
+
+    assert write_coordinator.writes == 20
+    assert write_coordinator.batches < 20
+    assert len(client.get("/api/customers/").json()) == 20
+
+def test_write_coordinator_isolates_failed_writes(write_coordinator, create_customer):
+    response = client.post("/api/customers/batch", json=[_batch_customer(create_customer)])
+    assert response.status_code == 400
+
+    response = client.put(f"/api/customers/{create_customer}/status", json={"status": "approved"})
+    assert response.status_code == 200
+    assert client.get(f"/api/customers/{create_customer}").json()["status"] == "approved"
+
+    order = client.post("/api/orders/", json={
+        "customer_id": create_customer,
+        "items": [{"product_name": "Pallet", "quantity": 2, "unit_price": 10.0}]
+    })
+    assert order.status_code == 201
+    assert client.get(f"/api/orders/{order.json()['id']}").json()["total_amount"] == 20.0
+
+def test_write_coordinator_rolls_back_only_the_failing_savepoint():
+    coordinator = WriteCoordinator(SessionLocal, max_batch=10, max_delay=0.2)
+
+    def fail(session):
+        session.add(CustomerModel(company_name="Doomed Company"))
+        session.flush()
+        raise ValueError("rejected")
+
+    try:
+        failed = coordinator.submit(fail)
+        kept = coordinator.submit(lambda session: session.add(CustomerModel(company_name="Kept Company")))
+        assert kept.result() is None
+        with pytest.raises(ValueError):
+            failed.result()
+    finally:
+        coordinator.stop()
+
+    assert coordinator.batches == 1
+    assert [c["company_name"] for c in client.get("/api/customers/").json()] == ["Kept Company"]
+
+def test_concurrent_read_then_write_transactions_without_coordinator():
+    # Both handlers read before they write; SQLite must not refuse to upgrade their transactions
+    client.post("/api/customers/batch", json=[_batch_customer(f"Contended Company {i}") for i in range(8)])
+
+    def create_batch(i):
+        payload = [_batch_customer(f"Concurrent Batch {i}-{j}") for j in range(10)]
+        return client.post("/api/customers/batch", json=payload).status_code
+
+    def update_status(i):
+        response = client.put(f"/api/customers/Contended Company {i % 8}/status", json={"status": f"state-{i}"})
+        return response.status_code
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        batches = [pool.submit(create_batch, i) for i in range(32)]
+        updates = [pool.submit(update_status, i) for i in range(32)]
+        assert [future.result() for future in batches] == [201] * 32
+        assert [future.result() for future in updates] == [200] * 32
+
+# Customer Cache Tests
+def test_get_customer_is_served_from_cache(create_customer):
+    assert client.get(f"/api/customers/{create_customer}").status_code == 200
+    with count_queries(engine) as statements:
+        response = client.get(f"/api/customers/{create_customer}")
+    assert response.json()["company_name"] == create_customer
+    assert statements == []
+    assert customer_cache.stats()["hits"] >= 1
+
+def test_customer_cache_invalidated_on_writes(create_customer):
+    assert client.get(f"/api/customers/{create_customer}").json()["status"] == "pending"
+    client.put(f"/api/customers/{create_customer}/status", json={"status": "approved"})
+    assert client.get(f"/api/customers/{create_customer}").json()["status"] == "approved"
+
+    assert client.get("/api/customers/Late Company").status_code == 404
+    client.post("/api/customers/batch", json=[_batch_customer("Late Company")])
+    assert client.get("/api/customers/Late Company").status_code == 200
+
+def test_memory_backend_lru_and_ttl():
+    now = [0.0]
+    cache = RecordCache(MemoryBackend(max_size=2, ttl=10, clock=lambda: now[0]))
+    load = lambda key: key.upper()
+    cache.get("a", load)
+    cache.get("b", load)
+    cache.get("a", load)
+    cache.get("c", load)  # evicts "b", the least recently used
+    assert "b" not in cache.backend._entries
+    now[0] = 11
+    cache.get("a", load)  # expired
+    assert cache.stats() == {
+        "hits": 1, "misses": 4, "evictions": 1, "invalidations": 0, "size": 2, "hit_ratio": 0.2
+    }
+
+def test_disk_backend_round_trip(tmp_path):
+    backend = DiskBackend(str(tmp_path / "cache.db"), max_size=1)
+    backend.set("a", {"status": "pending"})
+    assert backend.get("a") == {"status": "pending"}
+    assert backend.set("b", {"status": "approved"}) == 1
+    assert backend.get("a") is MISSING
+    assert len(backend) == 1
+
+def test_peek_counts_misses():
+    cache = RecordCache(MemoryBackend())
+    cache.put("a", 1)
+    assert cache.peek("a") == 1
+    assert cache.peek("b") is MISSING
+    assert (cache.hits, cache.misses, cache.stats()["hit_ratio"]) == (1, 1, 0.5)
+
+def test_cache_backend_is_shared_across_workers(monkeypatch, tmp_path):
+    monkeypatch.setenv("CUSTOMER_CACHE_PATH", str(tmp_path / "shared.db"))
+    assert isinstance(RecordCache.from_env("CUSTOMER_CACHE").backend, MemoryBackend)
+
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    first, second = RecordCache.from_env("CUSTOMER_CACHE"), RecordCache.from_env("CUSTOMER_CACHE")
+    assert isinstance(first.backend, DiskBackend)
+    first.put("Shared Company", {"status": "pending"})
+    second.invalidate(["Shared Company"])
+    assert first.peek("Shared Company") is MISSING
+
+# Single-flight Tests
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    started = threading.Event()
+    calls = []
+
+    def lookup():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return {"status": "approved"}
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        leader = pool.submit(flight.do, "acme", lookup)
+        started.wait()
+        followers = [pool.submit(flight.do, "acme", lookup) for _ in range(4)]
+        results = [leader.result()] + [f.result() for f in followers]
+
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    assert (flight.calls, flight.shared) == (1, 4)
+    assert flight.do("acme", lambda: "fresh") == "fresh"
+
+def test_async_single_flight_shares_results_and_errors():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def lookup():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 42
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise LookupError("gone")
+
+    async def scenario():
+        values = await asyncio.gather(*(flight.do(1, lookup) for _ in range(10)))
+        errors = await asyncio.gather(*(flight.do(2, failing) for _ in range(3)), return_exceptions=True)
+        return values, errors
+
+    values, errors = asyncio.run(scenario())
+    assert values == [42] * 10
+    assert calls == [1]
+    assert all(isinstance(error, LookupError) for error in errors)
+    assert flight.shared == 11
+
+# Response Tests
+def test_order_responses_keep_their_schema(create_customer):
+    created = client.post("/api/orders/", json={
+        "customer_id": create_customer,
+        "items": [{"product_name": "Crate", "quantity": 3, "unit_price": 2.5}]
+    })
+    assert created.status_code == 201
+    assert created.headers["content-type"] == "application/json"
+    order = client.get(f"/api/orders/{created.json()['id']}").json()
+    assert order == created.json()
+    assert set(order) == {"id", "customer_id", "order_date", "total_amount", "status", "items"}
+    assert datetime.fromisoformat(order["order_date"])
+
+    customer = client.get(f"/api/customers/{create_customer}").json()
+    assert customer["registration_date"] == "2025-03-31T12:00:00"
+
+def test_fast_json_response_without_orjson(monkeypatch):
+    monkeypatch.setattr("src.responses.orjson", None)
+    body = FastJSONResponse({"when": datetime(2025, 3, 31, 12, 0), "name": "Café"}).body
+    assert json.loads(body) == {"when": "2025-03-31T12:00:00", "name": "Café"}
+
+# Export Tests
+def test_export_customers_csv_and_ndjson():
+    client.post("/api/customers/batch", json=[_batch_customer(f"Export Company {i}") for i in range(3)])
+
+    response = client.get("/api/export/customers")
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["company_name"] for row in rows] == [f"Export Company {i}" for i in range(3)]
+    assert rows[0]["registration_date"] == "2025-03-31T12:00:00"
+
+    response = client.get("/api/export/customers", params={"format": "ndjson"})
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert [record["credit_score"] for record in records] == [750, 750, 750]
+
+def test_export_orders_streams_across_chunks(create_customer, monkeypatch):
+    monkeypatch.setattr("src.exports.EXPORT_CHUNK_SIZE", 2)
+    for quantity in (1, 2):
+        client.post("/api/orders/", json={
+            "customer_id": create_customer,
+            "items": [
+                {"product_name": "Crate", "quantity": quantity, "unit_price": 5.0},
+                {"product_name": "Lid", "quantity": quantity, "unit_price": 1.0},
+                {"product_name": "Strap", "quantity": quantity, "unit_price": 0.5}
+            ]
+        })
+
+    response = client.get("/api/export/orders", params={"format": "ndjson"})
+    orders = [json.loads(line) for line in response.text.splitlines()]
+    assert [order["id"] for order in orders] == [1, 2]
+    assert [len(order["items"]) for order in orders] == [3, 3]
+    assert orders[1]["items"][2] == {"product_name": "Strap", "quantity": 2, "unit_price": 0.5}
+
+    rows = list(csv.DictReader(io.StringIO(client.get("/api/export/orders").text)))
+    assert len(rows) == 6
+    assert rows[3]["order_id"] == "2" and rows[3]["product_name"] == "Crate"
+
+# Conditional GET Tests
+def test_customer_etag_and_conditional_get(create_customer):
+    first = client.get(f"/api/customers/{create_customer}")
+    etag = first.headers["ETag"]
+    assert etag == '"1"'
+    assert "Last-Modified" in first.headers
+
+    with count_queries(engine) as statements:
+        cached = client.get(f"/api/customers/{create_customer}", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert len(statements) == 1 and "version" in statements[0]
+
+    client.put(f"/api/customers/{create_customer}/status", json={"status": "approved"})
+    changed = client.get(f"/api/customers/{create_customer}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] == '"2"'
+    assert changed.json()["status"] == "approved"
+
+def test_order_conditional_get(create_customer):
+    order_id = client.post("/api/orders/", json={
+        "customer_id": create_customer,
+        "items": [{"product_name": "Crate", "quantity": 1, "unit_price": 5.0}]
+    }).json()["id"]
+    response = client.get(f"/api/orders/{order_id}")
+    assert response.headers["ETag"] == '"1"'
+
+    not_modified = client.get(f"/api/orders/{order_id}",
+                              headers={"If-Modified-Since": response.headers["Last-Modified"]})
+    assert not_modified.status_code == 304
+    assert client.get(f"/api/orders/{order_id}", headers={"If-None-Match": '"7"'}).status_code == 200
+
+def test_status_update_if_match(create_customer):
+    url = f"/api/customers/{create_customer}/status"
+    assert client.put(url, json={"status": "approved"}, headers={"If-Match": '"7"'}).status_code == 412
+    assert client.put(url, json={"status": "approved"}, headers={"If-Match": '"1"'}).status_code == 200
+    assert client.get(f"/api/customers/{create_customer}").headers["ETag"] == '"2"'
+
+def test_concurrent_status_update_conflicts(create_customer):
+    # Another writer bumps the version between this request's read and its versioned UPDATE
+    def concurrent_update(mapper, connection, target):
+        connection.exec_driver_sql(
+            "UPDATE customers SET version = version + 1 WHERE company_name = ?", (target.company_name,)
+        )
+
+    event.listen(CustomerModel, "before_update", concurrent_update)
+    try:
+        url = f"/api/customers/{create_customer}/status"
+        conflict = client.put(url, json={"status": "approved"})
+        precondition = client.put(url, json={"status": "approved"}, headers={"If-Match": "*"})
+    finally:
+        event.remove(CustomerModel, "before_update", concurrent_update)
+
+    assert conflict.status_code == 409
+    assert precondition.status_code == 412
+    assert client.get(f"/api/customers/{create_customer}").json()["status"] == "pending"
+
+# Field Projection Tests
+def test_customer_field_projection(create_customer):
+    with count_queries(engine) as statements:
+        response = client.get(f"/api/customers/{create_customer}", params={"fields": "status,approved_credit_limit"})
+    assert response.json() == {"approved_credit_limit": 500000.0, "status": "pending"}
+    assert "tax_id" not in statements[0] and "approved_credit_limit" in statements[0]
+
+    # Once the full record is cached the projection is served from memory
+    client.get(f"/api/customers/{create_customer}")
+    with count_queries(engine) as statements:
+        response = client.get(f"/api/customers/{create_customer}", params={"fields": "status"})
+    assert response.json() == {"status": "pending"}
+    assert statements == []
+
+    with count_queries(engine) as statements:
+        listing = client.get("/api/customers/", params={"fields": "company_name,credit_score"})
+    assert listing.json() == [{"company_name": create_customer, "credit_score": 800}]
+    assert "address" not in statements[0]
+
+    assert client.get("/api/customers/", params={"fields": "status,password"}).status_code == 400
+
+def test_order_field_projection_skips_items_query(create_customer):
+    order_id = client.post("/api/orders/", json={
+        "customer_id": create_customer,
+        "items": [{"product_name": "Crate", "quantity": 1, "unit_price": 5.0}]
+    }).json()["id"]
+
+    with count_queries(async_engine.sync_engine) as statements:
+        response = client.get(f"/api/orders/{order_id}", params={"fields": "status,total_amount"})
+    assert response.json() == {"total_amount": 5.0, "status": "pending"}
+    assert len(statements) == 1 and "order_date" not in statements[0]
+
+    response = client.get(f"/api/orders/{order_id}", params={"fields": "id,items"})
+    assert response.json() == {"id": order_id, "items": [{"product_name": "Crate", "quantity": 1, "unit_price": 5.0}]}
+
+# Multi-get Tests
+def test_lookup_customers_in_one_query():
+    client.post("/api/customers/batch", json=[_batch_customer(f"Lookup Company {i}") for i in range(3)])
+    names = ["Lookup Company 2", "Ghost Company", "Lookup Company 0", "Lookup Company 2"]
+
+    with count_queries(engine) as statements:
+        response = client.post("/api/customers/lookup", json={"company_names": names})
+    assert len(statements) == 1
+    body = response.json()
+    assert list(body["results"]) == ["Lookup Company 2", "Ghost Company", "Lookup Company 0"]
+    assert body["results"]["Lookup Company 0"]["contact_email"] == "batch@company.com"
+    assert body["results"]["Ghost Company"] is None
+    assert body["not_found"] == ["Ghost Company"]
+
+    # Found records are cached for the next lookup
+    with count_queries(engine) as statements:
+        client.post("/api/customers/lookup", json={"company_names": ["Lookup Company 0"]})
+    assert statements == []
+
+def test_lookup_orders_loads_items_in_one_extra_query(create_customer):
+    for quantity in (1, 2, 3):
+        client.post("/api/orders/", json={
+            "customer_id": create_customer,
+            "items": [{"product_name": "Crate", "quantity": quantity, "unit_price": 5.0}]
+        })
+
+    with count_queries(async_engine.sync_engine) as statements:
+        response = client.post("/api/orders/lookup", json={"order_ids": [3, 1, 99]})
+    assert len(statements) == 2
+    body = response.json()
+    assert body["results"]["3"]["items"][0]["quantity"] == 3
+    assert body["results"]["99"] is None
+    assert body["not_found"] == ["99"]
+
+    assert client.post("/api/orders/lookup", json={"order_ids": []}).status_code == 422
+
+# Compression Tests
+def test_large_listing_is_gzipped_and_small_body_is_not(create_customer):
+    client.post("/api/customers/batch", json=[_batch_customer(f"Gzip Company {i}") for i in range(20)])
+
+    response = client.get("/api/customers/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert len(response.json()) == 21
+
+    small = client.get(f"/api/customers/{create_customer}", params={"fields": "status"},
+                       headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    assert small.json() == {"status": "pending"}
+
+    identity = client.get("/api/customers/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers
+
+def test_streaming_export_is_compressed_in_chunks(monkeypatch):
+    monkeypatch.setattr("src.exports.EXPORT_CHUNK_SIZE", 5)
+    client.post("/api/customers/batch", json=[_batch_customer(f"Stream Company {i}") for i in range(30)])
+
+    with client.stream("GET", "/api/export/customers", params={"format": "ndjson"},
+                       headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        raw = b"".join(response.iter_raw())
+    lines = gzip.decompress(raw).decode().splitlines()
+    assert len(lines) == 30
+
+def test_route_can_opt_out_of_compression():
+    from fastapi import Depends, FastAPI
+    from fastapi.responses import PlainTextResponse
+
+    local_app = FastAPI()
+    local_app.add_middleware(CompressionMiddleware, minimum_size=10)
+
+    @local_app.get("/plain", dependencies=[Depends(no_compression)])
+    def plain():
+        return PlainTextResponse("x" * 1000)
+
+    @local_app.get("/packed")
+    def packed():
+        return PlainTextResponse("x" * 1000)
+
+    local_client = TestClient(local_app)
+    assert "content-encoding" not in local_client.get("/plain", headers={"Accept-Encoding": "gzip"}).headers
+    packed_response = local_client.get("/packed", headers={"Accept-Encoding": "gzip"})
+    assert packed_response.headers["content-encoding"] == "gzip"
+    assert packed_response.text == "x" * 1000
+
+def test_accept_encoding_q_values_are_honoured():
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse
+
+    local_app = FastAPI()
+    local_app.add_middleware(CompressionMiddleware, minimum_size=10)
+    local_app.add_api_route("/packed", lambda: PlainTextResponse("x" * 1000))
+    local_client = TestClient(local_app)
+
+    def encoding(accept_encoding):
+        response = local_client.get("/packed", headers={"Accept-Encoding": accept_encoding})
+        assert "Accept-Encoding" in response.headers["vary"]
+        return response.headers.get("content-encoding")
+
+    assert encoding("gzip;q=0") is None
+    assert encoding("gzip;q=0, identity") is None
+    assert encoding("*;q=0.5") == "gzip"
+    assert encoding("*, gzip;q=0") in (None, "br")
+    assert encoding("identity;q=1, gzip;q=0.3") == "gzip"
+
+def test_compressed_representation_has_its_own_etag(create_customer):
+    order_id = client.post("/api/orders/", json={
+        "customer_id": create_customer,
+        "items": [{"product_name": f"Component {i}", "quantity": i, "unit_price": 1.5} for i in range(1, 30)]
+    }).json()["id"]
+
+    identity = client.get(f"/api/orders/{order_id}", headers={"Accept-Encoding": "identity"})
+    packed = client.get(f"/api/orders/{order_id}", headers={"Accept-Encoding": "gzip"})
+    assert identity.headers["ETag"] == '"1"'
+    assert packed.headers["content-encoding"] == "gzip"
+    assert packed.headers["ETag"] == '"1-gzip"'
+    assert "Accept-Encoding" in identity.headers["vary"]
+
+    revalidated = client.get(f"/api/orders/{order_id}",
+                             headers={"Accept-Encoding": "gzip", "If-None-Match": packed.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert "Accept-Encoding" in revalidated.headers["vary"]
+
+# Idempotency Tests
+def test_retried_order_with_idempotency_key_is_not_duplicated(create_customer):
+    payload = {"customer_id": create_customer,
+               "items": [{"product_name": "Crate", "quantity": 2, "unit_price": 5.0}]}
+    headers = {"Idempotency-Key": "retry-1"}
+
+    first = client.post("/api/orders/", json=payload, headers=headers)
+    assert first.status_code == 201
+    assert "Idempotent-Replayed" not in first.headers
+
+    with count_queries(async_engine.sync_engine) as statements:
+        retry = client.post("/api/orders/", json=payload, headers=headers)
+    assert retry.status_code == 201
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+    assert not any(statement.startswith("INSERT") for statement in statements)
+    assert len(client.get("/api/orders/").json()) == 1
+
+    # Same key, different body
+    payload["items"][0]["quantity"] = 3
+    assert client.post("/api/orders/", json=payload, headers=headers).status_code == 422
+
+    # No key: every request creates an order
+    client.post("/api/orders/", json=payload)
+    assert len(client.get("/api/orders/").json()) == 2
+
+def test_expired_idempotency_keys_are_purged(create_customer, monkeypatch):
+    payload = {"customer_id": create_customer,
+               "items": [{"product_name": "Crate", "quantity": 1, "unit_price": 5.0}]}
+    client.post("/api/orders/", json=payload, headers={"Idempotency-Key": "old"})
+    with SessionLocal() as session:
+        session.get(IdempotencyKey, "old").created_at = datetime(2000, 1, 1)
+        session.commit()
+
+    monkeypatch.setattr("src.CustomerOnboarding._last_idempotency_purge", 0.0)
+    # The expired key no longer replays, and the next keyed write purges it
+    response = client.post("/api/orders/", json=payload, headers={"Idempotency-Key": "old"})
+    assert "Idempotent-Replayed" not in response.headers
+    assert response.json()["id"] == 2
+    with SessionLocal() as session:
+        assert session.get(IdempotencyKey, "old").created_at > datetime(2000, 1, 1)
+        assert session.query(IdempotencyKey).count() == 1
+
+# Admission Control Tests
+def test_admission_queue_admits_by_priority_and_sheds_when_full():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=2, queue_timeout=1)
+        assert await controller.acquire(NORMAL)
+
+        admitted = []
+        async def request(priority):
+            if await controller.acquire(priority):
+                admitted.append(priority)
+                controller.release()
+            return priority
+
+        low = asyncio.create_task(request(LOW))
+        normal = asyncio.create_task(request(NORMAL))
+        await asyncio.sleep(0)
+        assert controller.queued == 2
+        # Queue is full: a high-priority arrival displaces the low-priority waiter
+        high = asyncio.create_task(request(HIGH))
+        await asyncio.sleep(0)
+        # ...while another low-priority arrival is shed immediately
+        assert not await controller.acquire(LOW)
+
+        controller.release()
+        await asyncio.gather(low, normal, high)
+        assert admitted == [HIGH, NORMAL]
+        assert controller.shed == {"high": 0, "normal": 0, "low": 2}
+        assert (controller.in_flight, controller.queued) == (0, 0)
+
+    asyncio.run(scenario())
+
+def test_admission_sheds_after_queue_timeout():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=5, queue_timeout=0.01)
+        assert await controller.acquire(HIGH)
+        assert not await controller.acquire(HIGH)
+        assert controller.stats()["shed"]["high"] == 1
+        assert controller.queued == 0
+
+    asyncio.run(scenario())
+
+def test_overloaded_api_answers_503_with_retry_after(monkeypatch):
+    monkeypatch.setattr(admission_controller, "max_queue", 0)
+    monkeypatch.setattr(admission_controller, "in_flight", admission_controller.max_concurrency)
+    response = client.get("/api/orders/")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert admission_controller.shed["low"] >= 1
+
+    # Scrapes and admin endpoints are never shed
+    assert client.get("/metrics").status_code == 200
+    assert client.get("/admin/profiles/").status_code != 503
+
+# DB Executor Tests
+def test_customer_handlers_run_on_db_executor(create_customer):
+    assert db_executor.max_workers == pool_capacity(engine)
+    completed = db_executor.completed
+    assert client.get(f"/api/customers/{create_customer}").status_code == 200
+    assert client.get("/api/customers/").status_code == 200
+    assert db_executor.completed == completed + 2
+    assert db_executor.stats()["queue_depth"] == 0
+
+def test_db_executor_measures_queue_wait_and_keeps_context():
+    executor = DBExecutor(max_workers=1)
+    request_id = contextvars.ContextVar("request_id")
+
+    def work():
+        time.sleep(0.05)
+        return request_id.get()
+
+    async def scenario():
+        request_id.set("req-1")
+        return await asyncio.gather(executor.run(work), executor.run(work))
+
+    try:
+        assert asyncio.run(scenario()) == ["req-1", "req-1"]
+    finally:
+        executor.shutdown()
+    stats = executor.stats()
+    assert stats["completed"] == 2
+    assert stats["wait_seconds_max"] >= 0.04
+
+    handler = lambda: None
+    assert db_handler(None)(handler) is handler
+
+# App Factory Tests
+def test_import_opens_no_engine():
+    code = (
+        "import src.main, src.CustomerOnboarding as m; "
+        "assert m.get_engine.cache_info().currsize == 0; "
+        "assert m.get_async_engine.cache_info().currsize == 0"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == ""
+
+def test_default_env_file_uses_sqlite():
+    code = "import src.main, src.CustomerOnboarding as m; print(m.DATABASE_URL)"
+    env = {k: v for k, v in os.environ.items() if k != "DATABASE_URL"}
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().startswith("sqlite:")
+
+def test_lifespan_creates_schema():
+    Base.metadata.drop_all(bind=engine)
+    assert not inspect(engine).has_table("customers")
+    with TestClient(create_app()) as local_client:
+        assert inspect(engine).has_table("customers")
+        assert local_client.get("/api/customers/").json() == []
+
+# Server Launcher Tests
+def test_server_options_recycle_supervised_workers(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    options = server_options(parse_args(["--port", "8000", "--max-requests", "500"]))
+    assert options["factory"] is True
+    assert (options["port"], options["workers"]) == (8000, 4)
+    assert options["limit_max_requests"] == 500
+    assert options["limit_max_requests_jitter"] == 1000
+    assert options["loop"] in ("uvloop", "asyncio") and options["http"] in ("httptools", "h11")
+
+    # A lone worker has no supervisor to replace it
+    single = server_options(parse_args(["--workers", "1"]))
+    assert single["limit_max_requests"] is None
+
+def test_server_main_exports_worker_count(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr("src.server.uvicorn.run", lambda app, **options: calls.append(options))
+    monkeypatch.setenv("WEB_CONCURRENCY", "1")
+    monkeypatch.setenv("METRICS_MULTIPROC_DIR", str(tmp_path))
+    (tmp_path / "123.json").write_text("[]")
+    server_main(["--workers", "3"])
+    assert calls[0]["workers"] == 3
+    assert os.environ["WEB_CONCURRENCY"] == "3"
+    # Snapshots of the previous run are cleared
+    assert list(tmp_path.iterdir()) == []
+
+# Metrics Tests
+def test_metrics_endpoint_reports_routes_pool_and_cache(create_customer):
+    # Request metrics accumulate for the whole session on the shared app
+    app.state.metrics.requests.clear()
+    app.state.metrics.durations.clear()
+    client.get(f"/api/customers/{create_customer}")
+    client.get(f"/api/customers/{create_customer}")
+    client.get("/api/customers/Ghost")
+    client.get("/no/such/path")
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'http_requests_total{method="GET",route="/api/customers/{company_name}",status="200"} 2' in body
+    assert 'http_requests_total{method="GET",route="/api/customers/{company_name}",status="404"} 1' in body
+    assert 'route="unmatched",status="404"' in body
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/customers/{company_name}"} 3' in body
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert 'db_pool_checked_out{engine="sync",pool="QueuePool"}' in body
+    assert 'cache_hit_ratio{cache="customer"}' in body
+    assert 'admission_shed_total{priority="low"}' in body
+    # The in-flight gauge counts the scrape itself
+    assert "http_requests_in_flight 1" in body
+
+def test_latency_histogram_buckets_are_cumulative():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.1, 0.5, 3.0):
+        metrics.observe("GET", "/items", 200, seconds)
+    lines = metrics.render().splitlines()
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/items",le="0.1"} 2' in lines
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/items",le="1.0"} 3' in lines
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/items",le="+Inf"} 4' in lines
+    assert 'http_request_duration_seconds_sum{method="GET",route="/items"} 3.65' in lines
+    assert lines.count("# TYPE http_request_duration_seconds histogram") == 1
+
+def test_metrics_are_merged_across_workers(tmp_path):
+    # Another worker's snapshot, as left by its flush loop
+    other = Metrics(buckets=(0.1,), multiproc_dir=str(tmp_path))
+    other.observe("GET", "/items", 200, 0.05)
+    other.observe("POST", "/items", 201, 0.5)
+    other.in_flight = 2
+    other.write_snapshot()
+    os.replace(tmp_path / f"{os.getpid()}.json", tmp_path / "1.json")
+
+    metrics = Metrics(buckets=(0.1,), multiproc_dir=str(tmp_path))
+    metrics.observe("GET", "/items", 200, 0.2)
+    lines = metrics.render().splitlines()
+    assert 'http_requests_total{method="GET",route="/items",status="200"} 2' in lines
+    assert 'http_requests_total{method="POST",route="/items",status="201"} 1' in lines
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/items",le="0.1"} 1' in lines
+    assert 'http_request_duration_seconds_count{method="GET",route="/items"} 2' in lines
+    assert 'http_requests_in_flight{pid="1"} 2' in lines
+    assert f'http_requests_in_flight{{pid="{os.getpid()}"}} 0' in lines
+    assert lines.count("# TYPE http_requests_total counter") == 1
+    # A family's samples stay together
+    names = [line.split("{")[0] for line in lines if not line.startswith("#")]
+    assert names[:2] == ["http_requests_total"] * 2
+
+    # A worker that shuts down keeps its counters and drops its gauges
+    metrics.write_snapshot(live=False)
+    body = metrics.render()
+    assert 'http_requests_total{method="GET",route="/items",status="200"} 2' in body
+
+# Query Accounting Tests
+def test_read_endpoints_stay_within_query_budget(create_customer, query_budget):
+    for quantity in (1, 2, 3):
+        client.post("/api/orders/", json={
+            "customer_id": create_customer,
+            "items": [{"product_name": "Crate", "quantity": quantity, "unit_price": 5.0},
+                      {"product_name": "Lid", "quantity": quantity, "unit_price": 1.0}]
+        })
+
+    with query_budget(2) as requests:
+        client.get("/api/orders/1")
+        client.get("/api/orders/")
+        client.post("/api/orders/lookup", json={"order_ids": [1, 2, 3]})
+        client.get(f"/api/customers/{create_customer}")
+    assert [stats.count for _, _, stats in requests] == [2, 2, 2, 1]
+
+def test_repeated_statements_are_flagged_as_n_plus_one(create_customer):
+    from fastapi import FastAPI
+
+    local_app = FastAPI()
+    local_app.add_middleware(QueryStatsMiddleware, headers=True)
+
+    @local_app.get("/one-by-one")
+    def one_by_one():
+        with SessionLocal() as session:
+            for name in (create_customer, "Ghost 1", "Ghost 2"):
+                session.get(CustomerModel, name)
+        return {}
+
+    @local_app.get("/in-one-go")
+    def in_one_go():
+        with SessionLocal() as session:
+            session.query(CustomerModel).all()
+        return {}
+
+    local_client = TestClient(local_app)
+    response = local_client.get("/one-by-one")
+    assert response.headers["X-DB-Query-Count"] == "3"
+    assert response.headers["X-DB-N-Plus-One"] == "1"
+    assert float(response.headers["X-DB-Query-Time-Ms"]) > 0
+
+    response = local_client.get("/in-one-go")
+    assert response.headers["X-DB-Query-Count"] == "1"
+    assert "X-DB-N-Plus-One" not in response.headers
+
+def test_query_stats_summary():
+    stats = QueryStats()
+    for _ in range(3):
+        stats.record("SELECT 1", 0.001)
+    stats.record("SELECT 2", 0.001)
+    assert stats.n_plus_one_suspects() == ["SELECT 1"]
+    assert stats.n_plus_one_suspects(threshold=4) == []
+    assert stats.summary().splitlines()[1] == "  3x SELECT 1"
+
+# Slow Query Log Tests
+def test_slow_queries_are_logged_with_route_and_plan_once(create_customer, monkeypatch, caplog):
+    monkeypatch.setenv("SLOW_QUERY_MS", "0.000001")
+    caplog.set_level(logging.WARNING, logger="src.slow_query")
+    slow_app = create_app()
+    with TestClient(slow_app) as local_client:
+        local_client.get("/api/customers/pending/")
+        local_client.get("/api/customers/pending/", params={"limit": 5})
+    assert slow_app.state.slow_query_log.slow_queries >= 2
+
+    messages = [record.getMessage() for record in caplog.records if "FROM customers" in record.getMessage()]
+    first, second = messages[-2:]
+    assert "GET /api/customers/pending/" in first
+    assert "parameters=('pending'" in first
+    assert "plan:" in first and "ix_customers_status_company_name" in first
+    # Same statement shape, different parameters: its plan was already captured
+    assert "plan:" not in second
+
+def test_failed_explain_leaves_the_transaction_usable(create_customer):
+    with engine.connect() as conn:
+        conn.exec_driver_sql("UPDATE customers SET status = 'approved'")
+        # Trace the raw statements; on SQLite a failed statement would not abort anyway
+        statements = []
+        driver_connection = conn.connection.driver_connection
+        driver_connection.set_trace_callback(lambda sql: statements.append(sql.split()[0]))
+        plan = SlowQueryLog.explain(conn, "SELECT * FROM no_such_table", ())
+        driver_connection.set_trace_callback(None)
+        assert plan.startswith("(EXPLAIN failed:")
+        assert statements == ["SAVEPOINT", "ROLLBACK", "RELEASE"]
+        # The request's own work is intact and its transaction still commits
+        assert conn.exec_driver_sql("SELECT status FROM customers").scalar() == "approved"
+        conn.commit()
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT status FROM customers").scalar() == "approved"
+
+def test_slow_query_threshold_can_be_disabled(monkeypatch):
+    monkeypatch.setenv("SLOW_QUERY_MS", "0")
+    assert SlowQueryLog.from_env() is None
+
+# Profiling Tests
+def test_profiled_request_stores_summary_and_pstats(monkeypatch, tmp_path):
+    monkeypatch.setenv("PROFILING", "1")
+    monkeypatch.setenv("PROFILING_TOKEN", "s3cret")
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    local_client = TestClient(create_app())
+    customers = [_batch_customer(f"Profiled Company {i}") for i in range(200)]
+
+    response = local_client.post("/api/customers/batch", json=customers,
+                                 headers={"X-Profile": "1", "X-Admin-Token": "s3cret"})
+    assert response.status_code == 201
+    profile_id = response.headers["X-Profile-Id"]
+
+    admin = {"X-Admin-Token": "s3cret"}
+    assert local_client.get("/admin/profiles/", headers=admin).json() == [profile_id]
+    summary = local_client.get(f"/admin/profiles/{profile_id}", headers=admin).json()
+    assert summary["path"] == "/api/customers/batch"
+    # The handler ran on a DB executor thread and its time is in the profile
+    assert summary["categories"]["sqlalchemy"] > 0
+    assert summary["categories"]["pydantic"] > 0
+    assert summary["call_tree"][0]["callees"]
+    stats = pstats.Stats(str(tmp_path / f"{profile_id}.prof"))
+    assert stats.total_calls > 0
+    # Ranked among the event loop's wrapper frames, the handler is not always in the top rows
+    assert any(name == "insert_customers" and cumtime > 0
+               for (_, _, name), (_, _, _, cumtime, _) in stats.stats.items())
+
+    # Wrong token: served normally, not profiled, and the admin endpoints refuse it
+    response = local_client.get("/api/customers/", headers={"X-Profile": "1", "X-Admin-Token": "nope"})
+    assert "X-Profile-Id" not in response.headers
+    assert local_client.get("/admin/profiles/", headers={"X-Admin-Token": "nope"}).status_code == 403
+
+# Load Benchmark Tests
+def test_load_benchmark_percentiles_and_comparison():
+    values = sorted(i / 1000 for i in range(1, 101))
+    assert load_benchmark.percentile(values, 50) == 0.05
+    assert load_benchmark.percentile(values, 99) == 0.099
+    assert load_benchmark.percentile([], 95) is None
+    assert load_benchmark.parse_mix("create_order=3,get_order") == {"create_order": 3, "get_order": 1}
+    with pytest.raises(Exception):
+        load_benchmark.parse_mix("delete_everything=1")
+
+    def result(rps, p95):
+        summary = {"requests_per_second": rps, "p50_ms": 10.0, "p95_ms": p95, "p99_ms": None}
+        return {"scenarios": {"get_order": summary}, "overall": summary}
+
+    rows = load_benchmark.compare(result(100.0, 20.0), result(150.0, 10.0))
+    assert [row["scenario"] for row in rows] == ["get_order", "overall"]
+    assert rows[0]["requests_per_second_change_pct"] == 50.0
+    assert rows[0]["p95_ms_change_pct"] == -50.0
+    assert rows[0]["p99_ms_change_pct"] is None
+
+    # Client errors are part of the mix; any 5xx fails the run
+    errors = {"overall": {"error_kinds": {"404": 3, "500": 2, "503": 1, "ReadError": 1}}}
+    assert load_benchmark.server_errors(errors) == {"500": 2, "503": 1}
+
+def test_load_benchmark_inprocess_run():
+    args = load_benchmark.parse_args([
+        "run", "--requests", "40", "--concurrency", "4", "--warmup", "0",
+        "--seed-customers", "5", "--seed-orders", "5", "--mix", "create_order=1,get_order=2,list_orders=1",
+    ])
+    results = asyncio.run(load_benchmark.run_benchmark(args))
+
+    assert results["overall"]["requests"] == 40
+    assert results["overall"]["errors"] == 0
+    assert set(results["scenarios"]) == {"create_order", "get_order", "list_orders"}
+    assert results["overall"]["p50_ms"] <= results["overall"]["p95_ms"] <= results["overall"]["p99_ms"]
+    assert results["config"]["concurrency"] == 4
+    assert "commit" in results["git"]